@@ -18,14 +18,38 @@ __version__ = "1.0.0"
 __author__ = "Maximiliano Alarcón"
 __email__ = "your.email@example.com"
 
-# Importaciones principales para facilitar el uso
-from .access_schema import AccessSchema, obtener_metadata
-from .dispatcher import DJDispatcher, procesar_dj_desde_excel, procesar_dj_desde_dataframe
+import importlib
+
+# Importaciones principales para facilitar el uso.
+# Se resuelven en el primer acceso (PEP 562) para que `import core` no cargue
+# pandas, openpyxl ni pyodbc hasta que realmente se necesiten.
+_IMPORTS_DIFERIDOS = {
+    'AccessSchema': '.access_schema',
+    'obtener_metadata': '.access_schema',
+    'obtener_schema': '.access_schema',
+    'DJDispatcher': '.dispatcher',
+    'procesar_dj_desde_excel': '.dispatcher',
+    'procesar_dj_desde_dataframe': '.dispatcher',
+}
 
 __all__ = [
     'AccessSchema',
     'obtener_metadata', 
+    'obtener_schema',
     'DJDispatcher',
     'procesar_dj_desde_excel',
     'procesar_dj_desde_dataframe'
 ]
+
+
+def __getattr__(name):
+    if name in _IMPORTS_DIFERIDOS:
+        modulo = importlib.import_module(_IMPORTS_DIFERIDOS[name], __name__)
+        valor = getattr(modulo, name)
+        globals()[name] = valor
+        return valor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
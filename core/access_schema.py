@@ -5,11 +5,82 @@ Proporciona funciones para extraer información de tablas DECLARACIONES, CAMPOS
 
 import pyodbc
 import pandas as pd
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, List, Optional, Any, Tuple, TypeVar
+import importlib.util
 import os
+import sys
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
 
+# Cache de metadata y tablas lookup a nivel de módulo.
+# La clave incluye la fecha de modificación del .accdb para invalidar
+# automáticamente cuando la base de datos cambia.
+_METADATA_CACHE: Dict[tuple, Dict[str, Any]] = {}
+_LOOKUP_CACHE: Dict[tuple, pd.DataFrame] = {}
+
+# Backend de tipos para las tablas lookup. Por defecto NumPy; el backend Arrow
+# (strings compactos) se activa explícitamente con configurar_backend_lookup,
+# ya que sus celdas vacías son pd.NA en lugar de None/NaN.
+_DTYPE_BACKEND_LOOKUP: Optional[str] = None
+
+
+def configurar_backend_lookup(dtype_backend: Optional[str]) -> None:
+    """
+    Elige el backend de tipos con que se cargan las tablas lookup.
+    
+    Args:
+        dtype_backend: 'pyarrow' (requiere pandas >= 2 y pyarrow), 'numpy_nullable'
+            o None para los tipos NumPy por defecto
+    """
+    global _DTYPE_BACKEND_LOOKUP
+    
+    if dtype_backend not in (None, 'pyarrow', 'numpy_nullable'):
+        raise ValueError(f"dtype_backend no soportado: {dtype_backend}")
+    if dtype_backend is not None and int(pd.__version__.split('.')[0]) < 2:
+        raise ValueError("dtype_backend requiere pandas >= 2")
+    if dtype_backend == 'pyarrow' and importlib.util.find_spec('pyarrow') is None:
+        raise ValueError("El backend 'pyarrow' requiere tener pyarrow instalado")
+    
+    if dtype_backend != _DTYPE_BACKEND_LOOKUP:
+        # Las tablas ya cargadas tienen los tipos del backend anterior
+        _LOOKUP_CACHE.clear()
+    _DTYPE_BACKEND_LOOKUP = dtype_backend
+
+
+T = TypeVar('T')
+
+
+def _es_error_odbc(error: BaseException) -> bool:
+    """Indica si el error viene del driver ODBC (pd.read_sql lo envuelve en DatabaseError)."""
+    return isinstance(error, pyodbc.Error) or isinstance(error.__cause__, pyodbc.Error)
+
+
+def _intern(valor: Any) -> Any:
+    """Interna strings repetitivos (tipos, alineaciones, secciones) para compartir una sola instancia."""
+    return sys.intern(valor) if isinstance(valor, str) else valor
+
+
+def _compilar_expresion(expresion_py: Any, origen: str) -> Optional[Any]:
+    """
+    Compila una EXPRESION_PY para evaluarla sin volver a parsearla en cada fila.
+    
+    Returns:
+        Objeto code, o None si la expresión no es válida (el error se reporta al evaluar)
+    """
+    try:
+        return compile(expresion_py, origen, 'eval')
+    except (SyntaxError, TypeError, ValueError):
+        return None
+
+
+def limpiar_cache() -> None:
+    """Vacía los caches de metadata y tablas lookup."""
+    _METADATA_CACHE.clear()
+    _LOOKUP_CACHE.clear()
+
+
 class AccessSchema:
     """Clase para manejar la conexión y consultas a la base de datos Access."""
     
@@ -31,12 +102,106 @@ class AccessSchema:
             f"DBQ={self.db_path};"
         )
         
+        # Una conexión reutilizable por hilo (pyodbc no comparte conexiones entre hilos)
+        self._local = threading.local()
+        
     def _get_connection(self) -> pyodbc.Connection:
-        """Obtiene una conexión a la base de datos Access."""
+        """
+        Obtiene una conexión a la base de datos Access.
+        
+        La conexión se abre la primera vez y se reutiliza en llamadas
+        posteriores del mismo hilo mientras siga abierta.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and not getattr(conn, 'closed', False):
+            return conn
+        
         try:
-            return pyodbc.connect(self.connection_string)
+            # Transacciones manuales desde la primera sentencia (commit explícito)
+            conn = pyodbc.connect(self.connection_string, autocommit=False)
         except pyodbc.Error as e:
             raise ConnectionError(f"Error conectando a Access: {e}")
+        
+        self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def _conexion(self):
+        """
+        Context manager sobre la conexión reutilizable.
+        
+        Confirma al salir (igual que `with conn:` de pyodbc) y descarta la
+        conexión si el driver reporta un error, para reconectar en la próxima llamada.
+        """
+        conn = self._get_connection()
+        # Bloques abiertos en este hilo: una lectura anidada en otro bloque (p. ej.
+        # una transacción de escritura) no debe descartar la conexión para reintentar
+        self._local.abiertas = getattr(self._local, 'abiertas', 0) + 1
+        try:
+            with conn:
+                yield conn
+        except pyodbc.Error:
+            # Solo el bloque exterior descarta la conexión (el exterior hace rollback)
+            if self._local.abiertas == 1:
+                self.close()
+            raise
+        finally:
+            self._local.abiertas -= 1
+    
+    def _consultar(self, consulta: Callable[[pyodbc.Connection], T]) -> T:
+        """
+        Ejecuta una consulta de solo lectura sobre la conexión reutilizable.
+        
+        Si falla por un error del driver sobre una conexión reutilizada (p. ej.
+        una conexión vencida), la descarta y reintenta una sola vez con una
+        conexión nueva. No se reintenta dentro de otro bloque de _conexion, y
+        las escrituras usan _conexion directamente, sin reintento.
+        
+        Args:
+            consulta: Función que recibe la conexión y devuelve el resultado
+        """
+        conn = getattr(self._local, 'conn', None)
+        reutilizada = conn is not None and not getattr(conn, 'closed', False)
+        # Dentro de otro bloque de _conexion no se descarta la conexión: se perdería su transacción
+        anidada = bool(getattr(self._local, 'abiertas', 0))
+        
+        try:
+            with self._conexion() as conn:
+                return consulta(conn)
+        except Exception as e:
+            if anidada or not _es_error_odbc(e):
+                raise
+            # _conexion solo descarta la conexión ante pyodbc.Error directo
+            self.close()
+            if not reutilizada:
+                raise
+        
+        with self._conexion() as conn:
+            return consulta(conn)
+    
+    def close(self) -> None:
+        """Cierra la conexión del hilo actual, si existe."""
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except pyodbc.Error:
+                pass
+    
+    def __enter__(self) -> 'AccessSchema':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+    
+    def _cache_key(self, *partes: Any) -> tuple:
+        """Construye la clave de cache incluyendo el mtime de la base de datos."""
+        try:
+            mtime = os.path.getmtime(self.db_path)
+        except OSError:
+            mtime = None
+        return (self.db_path, *partes, mtime)
     
     def get_declaracion_info(self, dj_codigo: str) -> Dict[str, Any]:
         """
@@ -54,21 +219,23 @@ class AccessSchema:
         WHERE DJ_CODIGO = ?
         """
         
-        with self._get_connection() as conn:
+        def consulta(conn: pyodbc.Connection) -> Any:
             cursor = conn.cursor()
             cursor.execute(query, (dj_codigo,))
-            row = cursor.fetchone()
-            
-            if not row:
-                raise ValueError(f"Declaración {dj_codigo} no encontrada")
-            
-            return {
-                'dj_codigo': row.DJ_CODIGO,
-                'nombre': row.NOMBRE,
-                'tipo': row.TIPO,  # 'SIMPLE' o 'COMPUESTA'
-                'descripcion': row.DESCRIPCION,
-                'activa': row.ACTIVA
-            }
+            return cursor.fetchone()
+        
+        row = self._consultar(consulta)
+        
+        if not row:
+            raise ValueError(f"Declaración {dj_codigo} no encontrada")
+        
+        return {
+            'dj_codigo': row.DJ_CODIGO,
+            'nombre': row.NOMBRE,
+            'tipo': row.TIPO,  # 'SIMPLE' o 'COMPUESTA'
+            'descripcion': row.DESCRIPCION,
+            'activa': row.ACTIVA
+        }
     
     def get_campos_declaracion(self, dj_codigo: str) -> pd.DataFrame:
         """
@@ -102,8 +269,7 @@ class AccessSchema:
         ORDER BY POSICION
         """
         
-        with self._get_connection() as conn:
-            return pd.read_sql(query, conn, params=(dj_codigo,))
+        return self._consultar(lambda conn: pd.read_sql(query, conn, params=(dj_codigo,)))
     
     def get_validaciones_declaracion(self, dj_codigo: str) -> pd.DataFrame:
         """
@@ -115,6 +281,16 @@ class AccessSchema:
         Returns:
             DataFrame con información de las validaciones
         """
+        columnas, filas = self._get_validaciones_filas(dj_codigo)
+        return pd.DataFrame.from_records(filas, columns=columnas)
+    
+    def _get_validaciones_filas(self, dj_codigo: str) -> Tuple[List[str], List[tuple]]:
+        """
+        Obtiene las validaciones activas como tuplas, sin pasar por pd.read_sql.
+        
+        Returns:
+            Tupla (nombres de columnas, filas)
+        """
         query = """
         SELECT 
             VALIDACION_ID,
@@ -130,8 +306,13 @@ class AccessSchema:
         ORDER BY CAMPO_ID, CODIGO_VALIDACION
         """
         
-        with self._get_connection() as conn:
-            return pd.read_sql(query, conn, params=(dj_codigo,))
+        def consulta(conn: pyodbc.Connection) -> Tuple[List[str], List[tuple]]:
+            cursor = conn.cursor()
+            cursor.execute(query, (dj_codigo,))
+            columnas = [desc[0] for desc in cursor.description]
+            return columnas, [tuple(fila) for fila in cursor.fetchall()]
+        
+        return self._consultar(consulta)
     
     def get_tabla_lookup(self, tabla_nombre: str) -> pd.DataFrame:
         """
@@ -147,10 +328,18 @@ class AccessSchema:
         if not tabla_nombre.replace('_', '').replace('-', '').isalnum():
             raise ValueError(f"Nombre de tabla inválido: {tabla_nombre}")
         
+        key = self._cache_key('lookup', tabla_nombre)
+        if key in _LOOKUP_CACHE:
+            return _LOOKUP_CACHE[key].copy(deep=False)
+        
         query = f"SELECT * FROM {tabla_nombre}"
         
-        with self._get_connection() as conn:
-            return pd.read_sql(query, conn)
+        opciones_lectura = {'dtype_backend': _DTYPE_BACKEND_LOOKUP} if _DTYPE_BACKEND_LOOKUP else {}
+        
+        tabla_df = self._consultar(lambda conn: pd.read_sql(query, conn, **opciones_lectura))
+        
+        _LOOKUP_CACHE[key] = tabla_df
+        return tabla_df.copy(deep=False)
     
     def get_metadata_completa(self, dj_codigo: str) -> Dict[str, Any]:
         """
@@ -162,45 +351,50 @@ class AccessSchema:
         Returns:
             Diccionario con toda la metadata estructurada
         """
+        key = self._cache_key('metadata', dj_codigo)
+        if key in _METADATA_CACHE:
+            return self._copiar_metadata(_METADATA_CACHE[key])
+        
         # Información básica de la declaración
         declaracion_info = self.get_declaracion_info(dj_codigo)
         
         # Campos
         campos_df = self.get_campos_declaracion(dj_codigo)
         
-        # Validaciones
-        validaciones_df = self.get_validaciones_declaracion(dj_codigo)
+        # Validaciones (tuplas directas del cursor; el DataFrame se arma solo para el resultado)
+        columnas_val, filas_val = self._get_validaciones_filas(dj_codigo)
+        validaciones_df = pd.DataFrame.from_records(filas_val, columns=columnas_val)
         
         # Crear diccionario de campos indexado por código de campo
         campos_dict = {}
-        for _, campo in campos_df.iterrows():
-            campos_dict[campo['CODIGO_CAMPO']] = {
+        for campo in campos_df.to_dict(orient='records'):
+            campos_dict[_intern(campo['CODIGO_CAMPO'])] = {
                 'campo_id': campo['CAMPO_ID'],
                 'nombre': campo['NOMBRE_CAMPO'],
-                'tipo_dato': campo['TIPO_DATO'],
+                'tipo_dato': _intern(campo['TIPO_DATO']),
                 'longitud': campo['LONGITUD'],
                 'decimales': campo['DECIMALES'],
                 'obligatorio': campo['OBLIGATORIO'],
                 'posicion': campo['POSICION'],
-                'alineacion': campo['ALINEACION'],
-                'relleno': campo['RELLENO'],
+                'alineacion': _intern(campo['ALINEACION']),
+                'relleno': _intern(campo['RELLENO']),
                 'formato_ejemplo': campo['FORMATO_EJEMPLO'],
                 'descripcion': campo['DESCRIPCION'],
-                'seccion': campo['SECCION'],
-                'tabla_lookup': campo['TABLA_LOOKUP']
+                'seccion': _intern(campo['SECCION']),
+                'tabla_lookup': _intern(campo['TABLA_LOOKUP'])
             }
         
+        # Secciones presentes (DJ compuestas), calculadas una sola vez por carga
+        secciones = frozenset(info['seccion'] for info in campos_dict.values() if info['seccion'])
+        
+        # Índice inverso CAMPO_ID -> código de campo
+        id_a_codigo = {info['campo_id']: codigo for codigo, info in campos_dict.items()}
+        
         # Crear diccionario de validaciones agrupadas por campo
         validaciones_dict = {}
-        for _, validacion in validaciones_df.iterrows():
-            campo_id = validacion['CAMPO_ID']
-            
-            # Buscar el código de campo correspondiente
-            codigo_campo = None
-            for codigo, info in campos_dict.items():
-                if info['campo_id'] == campo_id:
-                    codigo_campo = codigo
-                    break
+        for fila_val in filas_val:
+            validacion = dict(zip(columnas_val, fila_val))
+            codigo_campo = id_a_codigo.get(validacion['CAMPO_ID'])
             
             if codigo_campo:
                 if codigo_campo not in validaciones_dict:
@@ -208,18 +402,49 @@ class AccessSchema:
                 
                 validaciones_dict[codigo_campo].append({
                     'codigo_validacion': validacion['CODIGO_VALIDACION'],
-                    'tipo_validacion': validacion['TIPO_VALIDACION'],
+                    'tipo_validacion': _intern(validacion['TIPO_VALIDACION']),
                     'expresion_py': validacion['EXPRESION_PY'],
+                    'expresion_code': _compilar_expresion(
+                        validacion['EXPRESION_PY'],
+                        f"<DJ{dj_codigo}:{validacion['CODIGO_VALIDACION']}>"
+                    ),
                     'mensaje_error': validacion['MENSAJE_ERROR']
                 })
         
-        return {
+        metadata = {
             'declaracion': declaracion_info,
             'campos': campos_dict,
             'validaciones': validaciones_dict,
+            'secciones': secciones,
             'campos_df': campos_df,
             'validaciones_df': validaciones_df
         }
+        
+        _METADATA_CACHE[key] = metadata
+        return self._copiar_metadata(metadata)
+    
+    @staticmethod
+    def _copiar_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Copia la metadata para que el llamador pueda modificarla sin alterar el cache.
+        
+        Se copian todos los contenedores mutables (dicts por campo, listas de
+        validaciones y DataFrames); los valores que contienen son inmutables
+        (strings, números, objetos code, frozenset).
+        """
+        copia = dict(metadata)
+        copia['declaracion'] = dict(metadata['declaracion'])
+        copia['campos'] = {
+            codigo: dict(info_campo) for codigo, info_campo in metadata['campos'].items()
+        }
+        copia['validaciones'] = {
+            codigo: [dict(validacion) for validacion in validaciones]
+            for codigo, validaciones in metadata['validaciones'].items()
+        }
+        for clave, valor in metadata.items():
+            if isinstance(valor, pd.DataFrame):
+                copia[clave] = valor.copy()
+        return copia
     
     def test_connection(self) -> bool:
         """
@@ -228,16 +453,41 @@ class AccessSchema:
         Returns:
             True si la conexión es exitosa, False en caso contrario
         """
+        def consulta(conn: pyodbc.Connection) -> None:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM DECLARACIONES")
+            cursor.fetchone()
+        
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM DECLARACIONES")
-                cursor.fetchone()
-                return True
+            self._consultar(consulta)
+            return True
         except Exception:
             return False
 
 
+# Instancias compartidas por ruta de base de datos (None = ruta por defecto)
+_SCHEMAS: Dict[Optional[str], AccessSchema] = {}
+
+
+def obtener_schema(db_path: str = None) -> AccessSchema:
+    """
+    Devuelve una instancia de AccessSchema compartida para la ruta indicada.
+    
+    Reutilizar la instancia permite reutilizar también su conexión ODBC.
+    
+    Args:
+        db_path: Ruta opcional al archivo Access
+        
+    Returns:
+        Instancia de AccessSchema asociada a db_path
+    """
+    clave = None if db_path is None else str(db_path)
+    schema = _SCHEMAS.get(clave)
+    if schema is None:
+        schema = _SCHEMAS[clave] = AccessSchema(db_path)
+    return schema
+
+
 # Función de conveniencia para uso directo
 def obtener_metadata(dj_codigo: str, db_path: str = None) -> Dict[str, Any]:
     """
@@ -250,8 +500,7 @@ def obtener_metadata(dj_codigo: str, db_path: str = None) -> Dict[str, Any]:
     Returns:
         Diccionario con toda la metadata
     """
-    schema = AccessSchema(db_path)
-    return schema.get_metadata_completa(dj_codigo)
+    return obtener_schema(db_path).get_metadata_completa(dj_codigo)
 
 
 if __name__ == "__main__":
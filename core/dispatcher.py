@@ -3,18 +3,38 @@ Módulo dispatcher que orquesta la validación y generación de DJs.
 Coordina el flujo completo desde la carga hasta la generación de archivos.
 """
 
+import copy
+import hashlib
+import json
+import os
+import time
 import pandas as pd
+from collections import OrderedDict
 from typing import Dict, Any, List, Optional, Union
 from pathlib import Path
 from datetime import datetime
 
-from .access_schema import AccessSchema, obtener_metadata
+from .access_schema import AccessSchema, obtener_metadata, obtener_schema
 from .validation.validator import DJValidator, validar_dj
 from .generation.generator_simple import GeneratorSimple, generar_archivo_simple
 from .generation.generator_compuesta import GeneratorCompuesta, generar_archivo_compuesto, validar_y_generar_compuesto
 from .storage.guardar_access import AccessStorage, guardar_dj_access
 from .templates.generar_template import TemplateGenerator, generar_template_dj
 
+# Máximo de resultados que guarda cada dispatcher (se descartan los menos usados)
+_MAX_RESULTADOS_CACHE = 32
+
+
+def _empresa_digest(empresa: Dict[str, Any]) -> str:
+    """
+    Huella corta y estable de los datos de la empresa.
+    
+    Se calcula una sola vez por proceso y se reutiliza en la clave de caché
+    y en el nombre por defecto del archivo de salida.
+    """
+    texto = json.dumps(empresa, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(texto.encode(), digest_size=8).hexdigest()
+
 
 class DJDispatcher:
     """Orquestador principal del sistema de DJs."""
@@ -26,8 +46,11 @@ class DJDispatcher:
         Args:
             db_path: Ruta opcional al archivo Access
         """
-        self.access_schema = AccessSchema(db_path)
+        self.access_schema = obtener_schema(db_path)
         self.db_path = db_path
+        
+        # Cache LRU de resultados exitosos indexado por hash de las entradas
+        self._resultado_cache: 'OrderedDict[str, tuple]' = OrderedDict()
     
     def procesar_dj_completo(self, 
                            dj_codigo: str,
@@ -52,9 +75,12 @@ class DJDispatcher:
         if opciones is None:
             opciones = {}
         
+        # Reloj monotónico para la duración; datetime solo para las marcas legibles
+        inicio_ns = time.perf_counter_ns()
         resultado = {
             "dj_codigo": dj_codigo,
             "empresa": empresa,
+            "empresa_digest": None,
             "inicio_proceso": datetime.now(),
             "pasos_completados": [],
             "errores": [],
@@ -62,7 +88,21 @@ class DJDispatcher:
             "exito": False
         }
         
+        clave_cache = None
+        
         try:
+            # Huella de la empresa: dentro del try para que una empresa no
+            # serializable se reporte en el resultado como cualquier otro error
+            empresa_digest = resultado["empresa_digest"] = _empresa_digest(empresa)
+            
+            # Reutilizar un resultado previo si las entradas no cambiaron.
+            # Guardar en Access es un efecto secundario, por lo que nunca se cachea.
+            if opciones.get("usar_cache", True) and not opciones.get("guardar_access", False):
+                clave_cache = self._clave_resultado(dj_codigo, empresa_digest, datos_entrada, opciones)
+                resultado_previo = self._leer_cache(clave_cache) if clave_cache else None
+                if resultado_previo is not None:
+                    return resultado_previo
+            
             # 1. Cargar metadata
             print(f"Cargando metadata para DJ {dj_codigo}...")
             metadata = self._cargar_metadata(dj_codigo)
@@ -92,7 +132,9 @@ class DJDispatcher:
             # 4. Generar archivo de salida (solo si los datos son válidos o si se fuerza)
             if resultado_validacion["valido"] or opciones.get("forzar_generacion", False):
                 print("Generando archivo de salida...")
-                archivo_salida = self._generar_archivo_salida(datos_procesados, metadata, empresa, opciones)
+                archivo_salida = self._generar_archivo_salida(
+                    datos_procesados, metadata, empresa, opciones, empresa_digest
+                )
                 resultado["archivos_generados"]["archivo_sii"] = archivo_salida
                 resultado["pasos_completados"].append("archivo_generado")
                 
@@ -115,12 +157,95 @@ class DJDispatcher:
         
         finally:
             resultado["fin_proceso"] = datetime.now()
-            resultado["duracion_total"] = (
-                resultado["fin_proceso"] - resultado["inicio_proceso"]
-            ).total_seconds()
+            resultado["duracion_total"] = (time.perf_counter_ns() - inicio_ns) / 1e9
+        
+        if clave_cache and resultado["exito"]:
+            self._guardar_cache(clave_cache, resultado)
         
         return resultado
     
+    def _leer_cache(self, clave_cache: str) -> Optional[Dict[str, Any]]:
+        """
+        Busca un resultado previo en el cache.
+        
+        Returns:
+            Copia profunda del resultado (marcada con desde_cache), o None si no
+            está o si el archivo generado ya no es el mismo
+        """
+        entrada_cache = self._resultado_cache.get(clave_cache)
+        if entrada_cache is None:
+            return None
+        
+        resultado_previo, mtime_archivo = entrada_cache
+        # El archivo debe seguir existiendo y no haber sido sobrescrito
+        if self._mtime_archivo(resultado_previo) != mtime_archivo:
+            del self._resultado_cache[clave_cache]
+            return None
+        
+        self._resultado_cache.move_to_end(clave_cache)
+        # Copia profunda: el llamador puede modificar listas y dicts anidados
+        # (errores, pasos, metadata) sin alterar la entrada cacheada
+        return {**copy.deepcopy(resultado_previo), "desde_cache": True}
+    
+    def _guardar_cache(self, clave_cache: str, resultado: Dict[str, Any]) -> None:
+        """Guarda una copia del resultado, descartando el menos usado si se supera el máximo."""
+        self._resultado_cache[clave_cache] = (copy.deepcopy(resultado), self._mtime_archivo(resultado))
+        self._resultado_cache.move_to_end(clave_cache)
+        while len(self._resultado_cache) > _MAX_RESULTADOS_CACHE:
+            self._resultado_cache.popitem(last=False)
+    
+    @staticmethod
+    def _mtime_archivo(resultado: Dict[str, Any]) -> Optional[int]:
+        """Fecha de modificación (ns) del archivo SII generado, o None si no existe."""
+        archivo = resultado["archivos_generados"].get("archivo_sii")
+        try:
+            return os.stat(archivo).st_mtime_ns if archivo else None
+        except OSError:
+            return None
+    
+    def _clave_resultado(self, dj_codigo: str, empresa_digest: str,
+                         datos_entrada: Union[str, pd.DataFrame, Dict[str, pd.DataFrame]],
+                         opciones: Dict[str, Any]) -> Optional[str]:
+        """
+        Calcula un hash de las entradas de procesar_dj_completo.
+        
+        Returns:
+            Clave hexadecimal, o None si las entradas no se pueden hashear
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(dj_codigo.encode())
+        
+        try:
+            # Base Access: metadata y reglas de validación cambian al editarla
+            db_path = self.access_schema.db_path
+            h.update(f"{os.path.abspath(db_path)}|{os.stat(db_path).st_mtime_ns}".encode())
+            
+            h.update(empresa_digest.encode())
+            h.update(json.dumps(opciones, sort_keys=True, default=str).encode())
+            
+            if isinstance(datos_entrada, str):
+                # Archivo Excel: ruta, fecha de modificación y tamaño
+                stat = os.stat(datos_entrada)
+                h.update(f"{os.path.abspath(datos_entrada)}|{stat.st_mtime_ns}|{stat.st_size}".encode())
+            elif isinstance(datos_entrada, pd.DataFrame):
+                self._hashear_dataframe(h, datos_entrada)
+            elif isinstance(datos_entrada, dict):
+                for seccion in sorted(datos_entrada):
+                    h.update(str(seccion).encode())
+                    self._hashear_dataframe(h, datos_entrada[seccion])
+            else:
+                return None
+        except (TypeError, ValueError, OSError):
+            return None
+        
+        return h.hexdigest()
+    
+    @staticmethod
+    def _hashear_dataframe(h: Any, df: pd.DataFrame) -> None:
+        """Agrega columnas y contenido de un DataFrame al hash."""
+        h.update(json.dumps([str(c) for c in df.columns]).encode())
+        h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    
     def _cargar_metadata(self, dj_codigo: str) -> Dict[str, Any]:
         """Carga metadata de la DJ desde Access."""
         return obtener_metadata(dj_codigo, self.db_path)
@@ -155,21 +280,32 @@ class DJDispatcher:
             dataframes_secciones = {}
             
             # Obtener secciones esperadas
-            secciones = set()
-            for info_campo in metadata['campos'].values():
-                if info_campo['seccion']:
-                    secciones.add(info_campo['seccion'])
+            secciones = self._obtener_secciones(metadata)
             
-            # Cargar cada sección
-            for seccion in secciones:
-                try:
-                    df_seccion = pd.read_excel(ruta_excel, sheet_name=seccion, header=1)
-                    dataframes_secciones[seccion] = df_seccion
-                except Exception as e:
-                    raise ValueError(f"Error cargando sección '{seccion}': {str(e)}")
+            # Abrir el libro una sola vez y leer cada sección desde él.
+            # La lectura es secuencial: el ExcelFile compartido no es seguro entre hilos
+            # y el parseo de openpyxl es Python puro, por lo que hilos no aceleran.
+            with pd.ExcelFile(ruta_excel) as libro:
+                for seccion in secciones:
+                    try:
+                        df_seccion = libro.parse(sheet_name=seccion, header=1)
+                        dataframes_secciones[seccion] = df_seccion
+                    except Exception as e:
+                        raise ValueError(f"Error cargando sección '{seccion}': {str(e)}")
             
             return dataframes_secciones
     
+    @staticmethod
+    def _obtener_secciones(metadata: Dict[str, Any]) -> frozenset:
+        """Secciones de la DJ, precalculadas en la metadata o derivadas de los campos."""
+        secciones = metadata.get('secciones')
+        if secciones is None:
+            secciones = frozenset(
+                info_campo['seccion'] for info_campo in metadata['campos'].values()
+                if info_campo['seccion']
+            )
+        return secciones
+    
     def _contar_filas_total(self, datos: Union[pd.DataFrame, Dict[str, pd.DataFrame]], 
                            metadata: Dict[str, Any]) -> int:
         """Cuenta el total de filas en los datos."""
@@ -235,39 +371,39 @@ class DJDispatcher:
         # Por simplicidad, creamos un reporte básico
         from openpyxl import Workbook
         
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Errores"
+        # Modo write_only: las filas se escriben en streaming sin crear celdas en memoria
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Errores")
         
         # Encabezados
-        ws['A1'] = 'Fila'
-        ws['B1'] = 'Columna'
-        ws['C1'] = 'Código Error'
-        ws['D1'] = 'Descripción'
+        ws.append(['Fila', 'Columna', 'Código Error', 'Descripción'])
         
         # Datos de errores
-        for i, error in enumerate(resultado_validacion["errores"], 2):
-            ws[f'A{i}'] = error.get("fila", "")
-            ws[f'B{i}'] = error.get("columna", "")
-            ws[f'C{i}'] = error.get("codigo", "")
-            ws[f'D{i}'] = error.get("error", "")
+        for error in resultado_validacion["errores"]:
+            ws.append([
+                error.get("fila", ""),
+                error.get("columna", ""),
+                error.get("codigo", ""),
+                error.get("error", "")
+            ])
         
         wb.save(output_path)
         return output_path
     
     def _generar_archivo_salida(self, datos: Union[pd.DataFrame, Dict[str, pd.DataFrame]], 
                                metadata: Dict[str, Any], empresa: Dict[str, Any],
-                               opciones: Dict[str, Any]) -> str:
+                               opciones: Dict[str, Any], empresa_digest: str = None) -> str:
         """Genera el archivo de salida según el tipo de DJ."""
         
         tipo_dj = metadata['declaracion']['tipo']
         dj_codigo = metadata['declaracion']['dj_codigo']
         output_path = opciones.get("ruta_archivo_salida")
         
+        # Sin ruta, el generador arma el nombre por defecto con la huella de la empresa
         if tipo_dj == 'SIMPLE':
-            return generar_archivo_simple(datos, dj_codigo, empresa, output_path, self.db_path)
+            return generar_archivo_simple(datos, dj_codigo, empresa, output_path, self.db_path, empresa_digest)
         else:
-            return generar_archivo_compuesto(datos, dj_codigo, empresa, output_path, self.db_path)
+            return generar_archivo_compuesto(datos, dj_codigo, empresa, output_path, self.db_path, empresa_digest)
     
     def _guardar_access(self, datos: Union[pd.DataFrame, Dict[str, pd.DataFrame]], 
                        metadata: Dict[str, Any], empresa: Dict[str, Any],
@@ -285,7 +421,9 @@ class DJDispatcher:
             generator = GeneratorCompuesta(metadata, empresa)
             df_a_guardar = generator.consolidar_dataframes(datos)
         
-        return guardar_dj_access(df_a_guardar, dj_codigo, empresa, tabla_destino, self.db_path)
+        batch_size = opciones.get("batch_size", 5000)
+        
+        return guardar_dj_access(df_a_guardar, dj_codigo, empresa, tabla_destino, self.db_path, batch_size)
     
     def generar_template(self, dj_codigo: str, output_path: str = None) -> str:
         """
@@ -326,11 +464,9 @@ class DJDispatcher:
         
         # Agrupar campos por sección
         if metadata['declaracion']['tipo'] == 'COMPUESTA':
-            secciones = set()
             for codigo_campo, info_campo in metadata['campos'].items():
                 seccion = info_campo['seccion']
                 if seccion:
-                    secciones.add(seccion)
                     if seccion not in info["campos_por_seccion"]:
                         info["campos_por_seccion"][seccion] = []
                     info["campos_por_seccion"][seccion].append({
@@ -340,7 +476,7 @@ class DJDispatcher:
                         "tipo": info_campo['tipo_dato']
                     })
             
-            info["resumen"]["secciones"] = sorted(list(secciones))
+            info["resumen"]["secciones"] = sorted(self._obtener_secciones(metadata))
         
         # Resumen de validaciones por campo
         for codigo_campo, validaciones in metadata['validaciones'].items():
@@ -357,9 +493,23 @@ class DJDispatcher:
         return info
 
 
+# Dispatchers compartidos por las funciones de conveniencia, por ruta de base de datos
+_DISPATCHERS: Dict[Optional[str], DJDispatcher] = {}
+
+
+def _obtener_dispatcher(db_path: str = None) -> DJDispatcher:
+    """Devuelve el dispatcher compartido para db_path, creándolo si no existe."""
+    clave = None if db_path is None else str(db_path)
+    dispatcher = _DISPATCHERS.get(clave)
+    if dispatcher is None:
+        dispatcher = _DISPATCHERS[clave] = DJDispatcher(db_path)
+    return dispatcher
+
+
 # Funciones de conveniencia
 def procesar_dj_desde_excel(ruta_excel: str, dj_codigo: str, empresa: Dict[str, Any],
-                           opciones: Dict[str, Any] = None, db_path: str = None) -> Dict[str, Any]:
+                           opciones: Dict[str, Any] = None, db_path: str = None,
+                           dispatcher: DJDispatcher = None) -> Dict[str, Any]:
     """
     Función de conveniencia para procesar DJ desde archivo Excel.
     
@@ -369,16 +519,19 @@ def procesar_dj_desde_excel(ruta_excel: str, dj_codigo: str, empresa: Dict[str,
         empresa: Datos de la empresa
         opciones: Opciones de procesamiento
         db_path: Ruta opcional al archivo Access
+        dispatcher: Dispatcher a usar; por defecto uno compartido para db_path
         
     Returns:
         Resultado del procesamiento
     """
-    dispatcher = DJDispatcher(db_path)
+    if dispatcher is None:
+        dispatcher = _obtener_dispatcher(db_path)
     return dispatcher.procesar_dj_completo(dj_codigo, empresa, ruta_excel, opciones)
 
 
 def procesar_dj_desde_dataframe(df: pd.DataFrame, dj_codigo: str, empresa: Dict[str, Any],
-                               opciones: Dict[str, Any] = None, db_path: str = None) -> Dict[str, Any]:
+                               opciones: Dict[str, Any] = None, db_path: str = None,
+                               dispatcher: DJDispatcher = None) -> Dict[str, Any]:
     """
     Función de conveniencia para procesar DJ desde DataFrame.
     
@@ -388,11 +541,13 @@ def procesar_dj_desde_dataframe(df: pd.DataFrame, dj_codigo: str, empresa: Dict[
         empresa: Datos de la empresa
         opciones: Opciones de procesamiento
         db_path: Ruta opcional al archivo Access
+        dispatcher: Dispatcher a usar; por defecto uno compartido para db_path
         
     Returns:
         Resultado del procesamiento
     """
-    dispatcher = DJDispatcher(db_path)
+    if dispatcher is None:
+        dispatcher = _obtener_dispatcher(db_path)
     return dispatcher.procesar_dj_completo(dj_codigo, empresa, df, opciones)
 
 
@@ -2,8 +2,15 @@
 Módulo de generación de archivos SII.
 """
 
-from .generator_simple import GeneratorSimple, generar_archivo_simple
-from .generator_compuesta import GeneratorCompuesta, generar_archivo_compuesto
+import importlib
+
+# Los generadores se importan en el primer acceso (PEP 562)
+_IMPORTS_DIFERIDOS = {
+    'GeneratorSimple': '.generator_simple',
+    'generar_archivo_simple': '.generator_simple',
+    'GeneratorCompuesta': '.generator_compuesta',
+    'generar_archivo_compuesto': '.generator_compuesta',
+}
 
 __all__ = [
     'GeneratorSimple', 
@@ -11,3 +18,16 @@ __all__ = [
     'GeneratorCompuesta', 
     'generar_archivo_compuesto'
 ]
+
+
+def __getattr__(name):
+    if name in _IMPORTS_DIFERIDOS:
+        modulo = importlib.import_module(_IMPORTS_DIFERIDOS[name], __name__)
+        valor = getattr(modulo, name)
+        globals()[name] = valor
+        return valor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -7,32 +7,36 @@ import pandas as pd
 from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
 from datetime import datetime
+from functools import cached_property
 from .generator_simple import GeneratorSimple
 from ..access_schema import AccessSchema, obtener_metadata
 
 
+# Antes de pandas 3, concat copia los bloques salvo que se pida copy=False.
+# Desde pandas 3 (Copy-on-Write) no copia y el parámetro está obsoleto.
+_CONCAT_SIN_COPIA = {'copy': False} if int(pd.__version__.split('.')[0]) < 3 else {}
+
+
 class GeneratorCompuesta:
     """Generador de archivos para DJs compuestas."""
     
-    def __init__(self, metadata: Dict[str, Any], empresa: Dict[str, Any]):
+    def __init__(self, metadata: Dict[str, Any], empresa: Dict[str, Any], empresa_digest: str = None):
         """
         Inicializa el generador con metadata y datos de empresa.
         
         Args:
             metadata: Metadata completa de la DJ obtenida de Access
             empresa: Diccionario con datos de la empresa
+            empresa_digest: Huella opcional de la empresa para el nombre por defecto del archivo
         """
         self.metadata = metadata
         self.empresa = empresa
+        self.empresa_digest = empresa_digest
         self.dj_codigo = metadata['declaracion']['dj_codigo']
         self.campos = metadata['campos']
         
         # Obtener extensión del archivo
         self.extension = self.dj_codigo[-3:] if len(self.dj_codigo) >= 3 else self.dj_codigo
-        
-        # Agrupar campos por sección
-        self.secciones = self._obtener_secciones()
-        self.campos_por_seccion = self._agrupar_campos_por_seccion()
     
     def consolidar_dataframes(self, dataframes_secciones: Dict[str, pd.DataFrame]) -> pd.DataFrame:
         """
@@ -45,25 +49,43 @@ class GeneratorCompuesta:
             DataFrame consolidado con todas las secciones
         """
         # Verificar que todas las secciones estén presentes
-        secciones_faltantes = set(self.secciones) - set(dataframes_secciones.keys())
+        secciones_faltantes = self._secciones_fs - dataframes_secciones.keys()
         if secciones_faltantes:
             raise ValueError(f"Faltan secciones: {', '.join(secciones_faltantes)}")
         
         # Determinar estrategia de consolidación
         return self._consolidar_por_concatenacion(dataframes_secciones)
     
-    def _consolidar_por_concatenacion(self, dataframes_secciones: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    def _verificar_secciones(self, dataframes_secciones: Dict[str, pd.DataFrame]) -> None:
         """
-        Consolida DataFrames concatenando columnas (estrategia más común).
-        Asume que todas las secciones tienen el mismo número de filas.
+        Verifica que estén todas las secciones y que tengan el mismo número de filas.
+        
+        Raises:
+            ValueError: Si falta alguna sección o los números de filas difieren
         """
-        # Verificar que todos los DataFrames tengan el mismo número de filas
+        secciones_faltantes = self._secciones_fs - dataframes_secciones.keys()
+        if secciones_faltantes:
+            raise ValueError(f"Faltan secciones: {', '.join(secciones_faltantes)}")
+        
+        self._verificar_num_filas(dataframes_secciones)
+    
+    @staticmethod
+    def _verificar_num_filas(dataframes_secciones: Dict[str, pd.DataFrame]) -> None:
+        """Verifica que todos los DataFrames tengan el mismo número de filas."""
         num_filas = None
         for seccion, df in dataframes_secciones.items():
             if num_filas is None:
                 num_filas = len(df)
             elif len(df) != num_filas:
                 raise ValueError(f"Sección '{seccion}' tiene {len(df)} filas, se esperaban {num_filas}")
+    
+    def _consolidar_por_concatenacion(self, dataframes_secciones: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+        """
+        Consolida DataFrames concatenando columnas (estrategia más común).
+        Asume que todas las secciones tienen el mismo número de filas.
+        """
+        # Verificar que todos los DataFrames tengan el mismo número de filas
+        self._verificar_num_filas(dataframes_secciones)
         
         # Concatenar por columnas en orden de sección
         dataframes_ordenados = []
@@ -71,8 +93,15 @@ class GeneratorCompuesta:
             if seccion in dataframes_secciones:
                 dataframes_ordenados.append(dataframes_secciones[seccion])
         
+        # Las secciones se alinean por posición de fila. Si los índices difieren,
+        # se reinician una vez para evitar la alineación por etiquetas de pandas.
+        if dataframes_ordenados:
+            indice_base = dataframes_ordenados[0].index
+            if not all(df.index.equals(indice_base) for df in dataframes_ordenados[1:]):
+                dataframes_ordenados = [df.reset_index(drop=True) for df in dataframes_ordenados]
+        
         # Concatenar horizontalmente
-        df_consolidado = pd.concat(dataframes_ordenados, axis=1)
+        df_consolidado = pd.concat(dataframes_ordenados, axis=1, sort=False, **_CONCAT_SIN_COPIA)
         
         return df_consolidado
     
@@ -81,25 +110,15 @@ class GeneratorCompuesta:
         Alternativa: Consolida DataFrames por unión vertical (menos común).
         Útil cuando las secciones representan diferentes tipos de registros.
         """
-        # Obtener todas las columnas únicas
-        todas_columnas = set()
-        for df in dataframes_secciones.values():
-            todas_columnas.update(df.columns)
-        
-        # Normalizar DataFrames para que tengan las mismas columnas
-        dataframes_normalizados = []
-        for seccion, df in dataframes_secciones.items():
-            df_normalizado = df.copy()
-            for columna in todas_columnas:
-                if columna not in df_normalizado.columns:
-                    df_normalizado[columna] = None
-            
-            # Agregar columna identificadora de sección
-            df_normalizado['_SECCION'] = seccion
-            dataframes_normalizados.append(df_normalizado)
+        # Concatenar verticalmente; el join externo completa las columnas
+        # faltantes con nulos en una sola asignación
+        df_consolidado = pd.concat(list(dataframes_secciones.values()), axis=0, join='outer',
+                                   ignore_index=True, sort=False, **_CONCAT_SIN_COPIA)
         
-        # Concatenar verticalmente
-        df_consolidado = pd.concat(dataframes_normalizados, axis=0, ignore_index=True)
+        # Agregar columna identificadora de sección
+        df_consolidado['_SECCION'] = [
+            seccion for seccion, df in dataframes_secciones.items() for _ in range(len(df))
+        ]
         
         return df_consolidado
     
@@ -115,15 +134,26 @@ class GeneratorCompuesta:
         Returns:
             Ruta del archivo generado
         """
-        # Consolidar DataFrames
-        df_consolidado = self.consolidar_dataframes(dataframes_secciones)
+        # Mismas verificaciones que la consolidación, pero sin armar el DataFrame
+        # combinado: el generador simple lee las columnas directo de cada sección
+        self._verificar_secciones(dataframes_secciones)
+        dataframes_ordenados = [
+            dataframes_secciones[seccion] for seccion in self.secciones if seccion in dataframes_secciones
+        ]
+        if not dataframes_ordenados:
+            raise ValueError("No hay secciones para generar el archivo")
         
         # Usar el generador simple para crear el archivo
-        generator_simple = GeneratorSimple(self.metadata, self.empresa)
-        return generator_simple.generar_archivo(df_consolidado, output_path)
+        return self._generator_simple.generar_archivo_por_partes(dataframes_ordenados, output_path)
     
-    def _obtener_secciones(self) -> List[str]:
-        """Obtiene lista única de secciones ordenadas."""
+    @cached_property
+    def _generator_simple(self) -> GeneratorSimple:
+        """Generador simple compartido (reutiliza sus campos ordenados y formateadores)."""
+        return GeneratorSimple(self.metadata, self.empresa, self.empresa_digest)
+    
+    @cached_property
+    def secciones(self) -> List[str]:
+        """Lista única de secciones ordenadas (se calcula una vez)."""
         secciones = set()
         for info_campo in self.campos.values():
             if info_campo['seccion']:
@@ -131,8 +161,9 @@ class GeneratorCompuesta:
         
         return sorted(list(secciones))
     
-    def _agrupar_campos_por_seccion(self) -> Dict[str, List[Dict[str, Any]]]:
-        """Agrupa campos por sección."""
+    @cached_property
+    def campos_por_seccion(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Campos agrupados por sección y ordenados por posición (se calcula una vez)."""
         campos_por_seccion = {}
         
         for codigo_campo, info_campo in self.campos.items():
@@ -152,6 +183,19 @@ class GeneratorCompuesta:
         
         return campos_por_seccion
     
+    @cached_property
+    def _secciones_fs(self) -> frozenset:
+        """Secciones esperadas como conjunto, para comparar contra las recibidas."""
+        return frozenset(self.secciones)
+    
+    @cached_property
+    def _columnas_esperadas_por_seccion(self) -> Dict[str, frozenset]:
+        """Códigos de campo esperados en cada sección."""
+        return {
+            seccion: frozenset(campo['codigo'] for campo in campos)
+            for seccion, campos in self.campos_por_seccion.items()
+        }
+    
     def validar_estructura_secciones(self, dataframes_secciones: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
         """
         Valida la estructura de los DataFrames de secciones antes de consolidar.
@@ -170,13 +214,13 @@ class GeneratorCompuesta:
         }
         
         # Verificar secciones requeridas
-        secciones_faltantes = set(self.secciones) - set(dataframes_secciones.keys())
+        secciones_faltantes = self._secciones_fs - dataframes_secciones.keys()
         if secciones_faltantes:
             resultado["valido"] = False
             resultado["errores"].append(f"Faltan secciones: {', '.join(secciones_faltantes)}")
         
         # Verificar secciones extra
-        secciones_extra = set(dataframes_secciones.keys()) - set(self.secciones)
+        secciones_extra = dataframes_secciones.keys() - self._secciones_fs
         if secciones_extra:
             resultado["advertencias"].append(f"Secciones no esperadas: {', '.join(secciones_extra)}")
         
@@ -202,8 +246,10 @@ class GeneratorCompuesta:
             # Verificar columnas esperadas para esta sección
             if seccion in self.campos_por_seccion:
                 columnas_esperadas = [campo['codigo'] for campo in self.campos_por_seccion[seccion]]
-                columnas_faltantes = set(columnas_esperadas) - set(df.columns)
-                columnas_extra = set(df.columns) - set(columnas_esperadas)
+                columnas_esperadas_fs = self._columnas_esperadas_por_seccion[seccion]
+                columnas_df = set(df.columns)
+                columnas_faltantes = columnas_esperadas_fs - columnas_df
+                columnas_extra = columnas_df - columnas_esperadas_fs
                 
                 if columnas_faltantes:
                     resultado["errores"].append(
@@ -237,8 +283,7 @@ class GeneratorCompuesta:
         df_consolidado = self.consolidar_dataframes(dataframes_secciones)
         
         # Usar el generador simple para obtener resumen básico
-        generator_simple = GeneratorSimple(self.metadata, self.empresa)
-        resumen_basico = generator_simple.generar_resumen(df_consolidado)
+        resumen_basico = self._generator_simple.generar_resumen(df_consolidado)
         
         # Agregar información específica de DJ compuesta
         resumen_secciones = {}
@@ -265,7 +310,8 @@ class GeneratorCompuesta:
 
 def generar_archivo_compuesto(dataframes_secciones: Dict[str, pd.DataFrame], 
                              dj_codigo: str, empresa: Dict[str, Any],
-                             output_path: str = None, db_path: str = None) -> str:
+                             output_path: str = None, db_path: str = None,
+                             empresa_digest: str = None) -> str:
     """
     Función de conveniencia para generar archivo de DJ compuesta.
     
@@ -275,6 +321,7 @@ def generar_archivo_compuesto(dataframes_secciones: Dict[str, pd.DataFrame],
         empresa: Diccionario con datos de la empresa
         output_path: Ruta donde guardar el archivo
         db_path: Ruta opcional al archivo Access
+        empresa_digest: Huella opcional de la empresa para el nombre por defecto
         
     Returns:
         Ruta del archivo generado
@@ -287,7 +334,7 @@ def generar_archivo_compuesto(dataframes_secciones: Dict[str, pd.DataFrame],
         raise ValueError(f"DJ {dj_codigo} no es de tipo COMPUESTA")
     
     # Crear generador y generar archivo
-    generator = GeneratorCompuesta(metadata, empresa)
+    generator = GeneratorCompuesta(metadata, empresa, empresa_digest)
     return generator.generar_archivo(dataframes_secciones, output_path)
 
 
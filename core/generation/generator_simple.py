@@ -3,27 +3,43 @@ Módulo para generar archivos de salida para Declaraciones Juradas simples.
 Convierte DataFrames validados en archivos de texto plano con formato específico del SII.
 """
 
+import numpy as np
 import pandas as pd
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable, Tuple
 from pathlib import Path
 import re
 from datetime import datetime
+from decimal import Decimal
+from functools import cached_property
 from ..access_schema import AccessSchema, obtener_metadata
 
 
+# Formatos de fecha reconocidos en la entrada (se compilan una sola vez)
+_FECHA_ISO = re.compile(r'\d{4}-\d{2}-\d{2}')          # YYYY-MM-DD
+_FECHA_DMY_BARRA = re.compile(r'\d{2}/\d{2}/\d{4}')    # DD/MM/YYYY
+_FECHA_DMY_GUION = re.compile(r'\d{2}-\d{2}-\d{4}')    # DD-MM-YYYY
+
+# Claves de memoización de _formatear_valores_unicos (ver _modo_clave)
+_CLAVE_VALOR = 0
+_CLAVE_REPR = 1
+_CLAVE_ZONA = 2
+
+
 class GeneratorSimple:
     """Generador de archivos para DJs simples."""
     
-    def __init__(self, metadata: Dict[str, Any], empresa: Dict[str, Any]):
+    def __init__(self, metadata: Dict[str, Any], empresa: Dict[str, Any], empresa_digest: str = None):
         """
         Inicializa el generador con metadata y datos de empresa.
         
         Args:
             metadata: Metadata completa de la DJ obtenida de Access
             empresa: Diccionario con datos de la empresa
+            empresa_digest: Huella opcional de la empresa para el nombre por defecto del archivo
         """
         self.metadata = metadata
         self.empresa = empresa
+        self.empresa_digest = empresa_digest
         self.dj_codigo = metadata['declaracion']['dj_codigo']
         self.campos = metadata['campos']
         
@@ -41,28 +57,80 @@ class GeneratorSimple:
         Returns:
             Ruta del archivo generado
         """
-        if output_path is None:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_path = f"DJ{self.dj_codigo}_{timestamp}.{self.extension}"
+        return self.generar_archivo_por_partes([df], output_path)
+    
+    def generar_archivo_por_partes(self, dataframes: List[pd.DataFrame], output_path: str = None) -> str:
+        """
+        Genera el archivo de salida a partir de varios DataFrames con las mismas filas.
         
-        # Obtener campos ordenados por posición
-        campos_ordenados = self._obtener_campos_ordenados()
+        El resultado es el mismo que concatenar los DataFrames por columnas
+        (pd.concat(axis=1)) y llamar a generar_archivo, sin armar el DataFrame combinado.
+        
+        Args:
+            dataframes: DataFrames validados, alineados por posición de fila
+            output_path: Ruta donde guardar el archivo. Si no se especifica, usa nombre por defecto.
+            
+        Returns:
+            Ruta del archivo generado
+        """
+        if output_path is None:
+            output_path = self.nombre_archivo_por_defecto()
+        
+        num_filas = len(dataframes[0]) if dataframes else 0
+        
+        # Ubicar cada columna; si un código se repite, prevalece la última aparición
+        columnas = {}
+        for df in dataframes:
+            for j, columna in enumerate(df.columns):
+                columnas[columna] = (df, j)
+        
+        # Tipo común de todas las columnas, el mismo que usaría df.values sobre el
+        # DataFrame combinado; así cada celda llega al formateador igual que con iterrows
+        tipo_comun = pd.concat([df.iloc[:0] for df in dataframes], axis=1).values.dtype if dataframes else None
+        if tipo_comun is not None and tipo_comun.kind in 'mM':
+            # iterrows entrega Timestamp/Timedelta, no datetime64 de NumPy
+            tipo_comun = object
+        
+        # Formatear columna por columna (campos en orden de posición) y armar las líneas al final
+        columnas_formateadas = []
+        for codigo_campo, info_campo, formateador in zip(self._codigos_ordenados, self._infos_ordenadas,
+                                                          self._formateadores):
+            ubicacion = columnas.get(codigo_campo)
+            serie = ubicacion[0].iloc[:, ubicacion[1]] if ubicacion is not None else None
+            columnas_formateadas.append(
+                self._formatear_columna(serie, tipo_comun, num_filas, info_campo, formateador)
+            )
         
         # Generar líneas del archivo
-        lineas = []
-        for _, fila in df.iterrows():
-            linea = self._generar_linea(fila, campos_ordenados)
-            lineas.append(linea)
+        if columnas_formateadas:
+            lineas = [''.join(partes) for partes in zip(*columnas_formateadas)]
+        else:
+            lineas = [''] * num_filas
         
-        # Escribir archivo
+        # Escribir archivo en una sola llamada. Se mantiene el modo texto para
+        # conservar el fin de línea de la plataforma (CRLF en Windows).
+        contenido = '\n'.join(lineas) + '\n' if lineas else ''
         with open(output_path, 'w', encoding='latin-1') as f:
-            for linea in lineas:
-                f.write(linea + '\n')
+            f.write(contenido)
         
         return output_path
     
-    def _obtener_campos_ordenados(self) -> List[Dict[str, Any]]:
-        """Obtiene lista de campos ordenados por posición para el archivo de salida."""
+    def nombre_archivo_por_defecto(self) -> str:
+        """
+        Nombre por defecto del archivo de salida.
+        
+        Returns:
+            DJ<código>_<timestamp>.<extensión>, con la huella de la empresa antes
+            del timestamp si se indicó (identifica la empresa sin exponer sus datos)
+        """
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if self.empresa_digest:
+            return f"DJ{self.dj_codigo}_{self.empresa_digest}_{timestamp}.{self.extension}"
+        return f"DJ{self.dj_codigo}_{timestamp}.{self.extension}"
+    
+    @cached_property
+    def campos_ordenados(self) -> List[Dict[str, Any]]:
+        """Lista de campos ordenados por posición para el archivo de salida (se calcula una vez)."""
         campos_lista = []
         for codigo_campo, info_campo in self.campos.items():
             campos_lista.append({
@@ -72,30 +140,284 @@ class GeneratorSimple:
         
         return sorted(campos_lista, key=lambda x: x['info']['posicion'])
     
-    def _generar_linea(self, fila: pd.Series, campos_ordenados: List[Dict[str, Any]]) -> str:
+    @cached_property
+    def _codigos_ordenados(self) -> List[str]:
+        """Códigos de campo en orden de posición."""
+        return [campo['codigo'] for campo in self.campos_ordenados]
+    
+    @cached_property
+    def _infos_ordenadas(self) -> List[Dict[str, Any]]:
+        """Información de formato de cada campo, paralela a _codigos_ordenados."""
+        return [campo['info'] for campo in self.campos_ordenados]
+    
+    @cached_property
+    def _formateadores(self) -> List[Callable[[Any], str]]:
+        """Formateador de cada campo, paralelo a _codigos_ordenados."""
+        return [self._crear_formateador(info_campo) for info_campo in self._infos_ordenadas]
+    
+    def _formatear_columna(self, serie: Optional[pd.Series], tipo_comun: Any, num_filas: int,
+                           info_campo: Dict[str, Any], formateador: Callable[[Any], str]) -> List[str]:
+        """
+        Formatea todos los valores de un campo.
+        
+        Args:
+            serie: Columna con los datos del campo, o None si no viene en la entrada
+            tipo_comun: Tipo NumPy con el que se leen las celdas (ver generar_archivo_por_partes)
+            num_filas: Número de filas del archivo
+            info_campo: Información de formato del campo
+            formateador: Formateador del campo (ver _crear_formateador)
+            
+        Returns:
+            Lista con el valor formateado de cada fila
+        """
+        # Columna ausente: el mismo valor vacío formateado en todas las filas
+        if serie is None:
+            return [formateador('')] * num_filas
+        
+        # Enteros sobre columnas numéricas: conversión en bloque con NumPy
+        tipo_dato = info_campo.get('tipo_dato', 'TEXT')
+        if tipo_dato in ['INTEGER', 'NUMERIC'] or (tipo_dato == 'DECIMAL' and info_campo.get('decimales', 0) == 0):
+            formateados = self._formatear_enteros_columna(serie, info_campo)
+            if formateados is not None:
+                return formateados
+        
+        # Decimales sobre columnas numéricas: se evita el paso por str/float de cada celda
+        decimales = info_campo.get('decimales', 0)
+        if tipo_dato == 'DECIMAL' and isinstance(decimales, int) and decimales > 0:
+            formateados = self._formatear_decimales_columna(serie, info_campo)
+            if formateados is not None:
+                return formateados
+        
+        valores = serie.to_numpy(dtype=tipo_comun)
+        
+        # Fechas: suelen repetirse mucho (cierres de período), se formatea cada valor distinto una vez
+        if tipo_dato == 'DATE':
+            return self._formatear_valores_unicos(valores, formateador)
+        
+        # Texto: conversión y recorte por celda, relleno y alineación en bloque
+        if tipo_dato not in ['INTEGER', 'NUMERIC', 'DECIMAL']:
+            return self._formatear_textos_columna(valores, info_campo)
+        
+        return [formateador(valor) for valor in valores]
+    
+    def _formatear_textos_columna(self, valores: np.ndarray, info_campo: Dict[str, Any]) -> List[str]:
+        """
+        Formatea como texto una columna completa.
+        
+        Equivale a aplicar _formatear_texto valor por valor (nulos como texto
+        vacío, sin espacios en los extremos y truncado a la longitud).
+        
+        Returns:
+            Lista con el valor formateado de cada fila
+        """
+        longitud = info_campo.get('longitud', 0)
+        relleno = info_campo.get('relleno', ' ')
+        alineacion = info_campo.get('alineacion', 'LEFT')
+        
+        textos = []
+        for valor in valores:
+            texto = '' if pd.isna(valor) or valor is None else str(valor).strip()
+            textos.append(texto[:longitud] if len(texto) > longitud else texto)
+        
+        # Los strings de NumPy descartan los caracteres nulos finales
+        if any('\x00' in texto for texto in textos):
+            return [self._aplicar_alineacion(texto, longitud, relleno, alineacion) for texto in textos]
+        
+        return self._alinear_columna(np.array(textos, dtype=str), longitud, relleno, alineacion).tolist()
+    
+    @staticmethod
+    def _formatear_valores_unicos(valores: Any, formateador: Callable[[Any], str]) -> List[str]:
+        """Aplica el formateador una sola vez por cada valor distinto de la columna."""
+        formateados = {}
+        modos = {}
+        resultado = []
+        for valor in valores:
+            # El tipo forma parte de la clave: True, 1 y 1.0 son iguales como claves pero se formatean distinto
+            tipo = type(valor)
+            modo = modos.get(tipo)
+            if modo is None:
+                modo = modos[tipo] = GeneratorSimple._modo_clave(tipo)
+            
+            if modo == _CLAVE_REPR:
+                clave = (tipo, repr(valor))
+            elif modo == _CLAVE_ZONA:
+                clave = (tipo, valor, valor.tzinfo)
+            else:
+                clave = (tipo, valor)
+            
+            try:
+                texto = formateados.get(clave)
+                if texto is None:
+                    texto = formateados[clave] = formateador(valor)
+            except TypeError:  # Valor no hasheable
+                texto = formateador(valor)
+            resultado.append(texto)
+        return resultado
+    
+    @staticmethod
+    def _modo_clave(tipo: type) -> int:
+        """
+        Cómo construir la clave de memoización para valores de un tipo.
+        
+        Dos valores iguales del mismo tipo deben tener el mismo texto. No ocurre
+        con los números no enteros (-0.0 == 0.0, Decimal('1.0') == Decimal('1')),
+        que se distinguen por repr, ni con fechas con zona horaria (el mismo
+        instante en otra zona), que agregan la zona a la clave.
+        """
+        if issubclass(tipo, (float, complex, Decimal, np.floating, np.complexfloating)):
+            return _CLAVE_REPR
+        if hasattr(tipo, 'tzinfo'):
+            return _CLAVE_ZONA
+        return _CLAVE_VALOR
+    
+    def _formatear_enteros_columna(self, serie: pd.Series, info_campo: Dict[str, Any]) -> Optional[List[str]]:
+        """
+        Formatea como entero una columna numérica completa.
+        
+        Equivale a aplicar _formatear_numerico valor por valor (nulos como 0,
+        truncando decimales), pero sin pasar cada celda por str/float/int.
+        
+        Returns:
+            Lista de valores formateados, o None si la columna no es numérica o
+            tiene valores fuera del rango de int64 (se usa el camino general)
+        """
+        numeros = self._numeros_columna(serie)
+        if numeros is None or not np.all(np.abs(numeros) < 2.0 ** 63):
+            return None
+        
+        longitud = info_campo.get('longitud', 0)
+        relleno = info_campo.get('relleno', ' ')
+        alineacion = info_campo.get('alineacion', 'LEFT')
+        
+        textos = np.trunc(numeros).astype(np.int64).astype(str)
+        return self._alinear_columna(textos, longitud, relleno, alineacion).tolist()
+    
+    def _formatear_decimales_columna(self, serie: pd.Series, info_campo: Dict[str, Any]) -> Optional[List[str]]:
+        """
+        Formatea como decimal una columna numérica completa.
+        
+        Equivale a aplicar _formatear_decimal valor por valor: mismo redondeo de
+        str.format, sin punto decimal y completado con ceros. Los valores se
+        escalan a enteros (valor × 10**decimales) y se convierten a texto en
+        bloque; solo los casos que el producto en float no resuelve con certeza
+        pasan por str.format.
+        
+        Returns:
+            Lista de valores formateados, o None si la columna no es numérica
+        """
+        numeros = self._numeros_columna(serie)
+        decimales = info_campo['decimales']
+        if numeros is None or decimales > 15:
+            return None
+        if numeros.size == 0:
+            # np.char.zfill no admite arreglos vacíos
+            return []
+        
+        longitud = info_campo.get('longitud', 0)
+        relleno = info_campo.get('relleno', ' ')
+        alineacion = info_campo.get('alineacion', 'LEFT')
+        
+        enteros, dudosos = self._escalar_decimales(numeros, decimales)
+        
+        # Dígitos del valor escalado, con al menos un entero antes de los decimales
+        textos = np.char.zfill(np.abs(enteros).astype(str), decimales + 1)
+        textos = np.char.add(np.where(np.signbit(numeros), '-', ''), textos)
+        
+        if dudosos.any():
+            formato = f"{{:.{decimales}f}}".format
+            textos = textos.astype(object)
+            for i in np.flatnonzero(dudosos):
+                textos[i] = formato(numeros[i]).replace('.', '')
+            textos = textos.astype(str)
+        
+        if longitud > 0 and textos.size:
+            textos = np.char.zfill(textos, longitud)
+        
+        return self._alinear_columna(textos, longitud, relleno, alineacion).tolist()
+    
+    @staticmethod
+    def _escalar_decimales(numeros: np.ndarray, decimales: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cuantiza valores decimales a enteros escalados por 10**decimales.
+        
+        str.format redondea el valor binario exacto al par más cercano. El producto
+        en float puede diferir de ese valor exacto en media unidad de precisión, lo
+        que solo cambia el resultado cuando queda casi a mitad de camino entre dos
+        enteros; esos casos (y los no finitos o fuera del rango exacto) se marcan
+        como dudosos.
+        
+        Returns:
+            Tupla (enteros escalados como int64, máscara de valores dudosos)
+        """
+        escalados = numeros * (10.0 ** decimales)
+        magnitud = np.abs(escalados)
+        with np.errstate(invalid='ignore'):
+            distancia_mitad = np.abs(magnitud - np.floor(magnitud) - 0.5)
+            dudosos = ~np.isfinite(escalados) | (magnitud >= 2.0 ** 53) | (distancia_mitad <= magnitud * 1e-15)
+        enteros = np.where(dudosos, 0.0, np.rint(escalados)).astype(np.int64)
+        return enteros, dudosos
+    
+    @staticmethod
+    def _numeros_columna(serie: pd.Series) -> Optional[np.ndarray]:
+        """Valores de una columna numérica como float64 con nulos en 0, o None si la columna no es numérica."""
+        if serie.dtype.kind not in 'iuf':
+            return None
+        
+        numeros = serie.to_numpy(dtype='float64', na_value=np.nan)
+        return np.where(np.isnan(numeros), 0.0, numeros)
+    
+    def _alinear_columna(self, textos: np.ndarray, longitud: int, relleno: str, alineacion: str) -> np.ndarray:
+        """
+        Versión para arreglos de _aplicar_alineacion: trunca y rellena toda la columna con NumPy.
+        
+        Args:
+            textos: Arreglo de strings de NumPy
+            longitud: Longitud final deseada
+            relleno: Carácter de relleno
+            alineacion: Tipo de alineación (LEFT, RIGHT, CENTER)
+            
+        Returns:
+            Arreglo de strings con la longitud especificada
+        """
+        if longitud <= 0 or textos.size == 0:
+            return textos
+        
+        if not relleno or len(relleno) != 1:
+            relleno = ' '
+        
+        # Los strings de NumPy descartan los caracteres nulos finales: relleno en Python
+        if relleno == '\x00':
+            return np.array(
+                [self._aplicar_alineacion(texto, longitud, relleno, alineacion)
+                 for texto in textos.tolist()],
+                dtype=object
+            )
+        
+        # Truncar al convertir a un tipo de ancho fijo
+        textos = textos.astype(f'U{longitud}')
+        
+        if alineacion == 'RIGHT':
+            return np.char.rjust(textos, longitud, relleno)
+        elif alineacion == 'CENTER':
+            return np.char.center(textos, longitud, relleno)
+        else:  # LEFT por defecto
+            return np.char.ljust(textos, longitud, relleno)
+    
+    def _generar_linea(self, fila: pd.Series) -> str:
         """
         Genera una línea del archivo a partir de una fila del DataFrame.
         
         Args:
             fila: Serie de pandas con los datos de la fila
-            campos_ordenados: Lista de campos ordenados por posición
             
         Returns:
             Línea formateada para el archivo
         """
         partes_linea = []
         
-        for campo in campos_ordenados:
-            codigo_campo = campo['codigo']
-            info_campo = campo['info']
-            
-            # Obtener valor de la fila
-            valor = fila.get(codigo_campo, '')
-            
-            # Formatear el valor según las especificaciones del campo
-            valor_formateado = self._formatear_valor(valor, info_campo)
-            
-            partes_linea.append(valor_formateado)
+        for codigo_campo, formateador in zip(self._codigos_ordenados, self._formateadores):
+            # Obtener valor de la fila y formatearlo según las especificaciones del campo
+            partes_linea.append(formateador(fila.get(codigo_campo, '')))
         
         return ''.join(partes_linea)
     
@@ -110,12 +432,21 @@ class GeneratorSimple:
         Returns:
             Valor formateado como string
         """
-        # Convertir a string y manejar valores nulos
-        if pd.isna(valor) or valor is None:
-            valor_str = ''
-        else:
-            valor_str = str(valor)
+        return self._crear_formateador(info_campo)(valor)
+    
+    def _crear_formateador(self, info_campo: Dict[str, Any]) -> Callable[[Any], str]:
+        """
+        Crea el formateador de un campo.
         
+        Los parámetros de formato y la función según tipo de dato se resuelven
+        una sola vez; el formateador resultante solo convierte y aplica.
+        
+        Args:
+            info_campo: Información del campo con longitud, tipo, alineación, etc.
+            
+        Returns:
+            Función que recibe un valor y lo devuelve formateado como string
+        """
         # Obtener parámetros de formato
         longitud = info_campo.get('longitud', 0)
         tipo_dato = info_campo.get('tipo_dato', 'TEXT')
@@ -123,17 +454,25 @@ class GeneratorSimple:
         relleno = info_campo.get('relleno', ' ')  # Carácter de relleno
         decimales = info_campo.get('decimales', 0)
         
-        # Formatear según tipo de dato
+        # Elegir formato según tipo de dato
         if tipo_dato in ['INTEGER', 'NUMERIC']:
-            valor_formateado = self._formatear_numerico(valor_str, decimales, longitud, relleno, alineacion)
+            formatear, parametros = self._formatear_numerico, (decimales, longitud, relleno, alineacion)
         elif tipo_dato == 'DECIMAL':
-            valor_formateado = self._formatear_decimal(valor_str, decimales, longitud, relleno, alineacion)
+            formatear, parametros = self._formatear_decimal, (decimales, longitud, relleno, alineacion)
         elif tipo_dato == 'DATE':
-            valor_formateado = self._formatear_fecha(valor_str, longitud, relleno, alineacion)
+            formatear, parametros = self._formatear_fecha, (longitud, relleno, alineacion)
         else:  # TEXT, VARCHAR, CHAR
-            valor_formateado = self._formatear_texto(valor_str, longitud, relleno, alineacion)
+            formatear, parametros = self._formatear_texto, (longitud, relleno, alineacion)
+        
+        def formateador(valor: Any) -> str:
+            # Convertir a string y manejar valores nulos
+            if pd.isna(valor) or valor is None:
+                valor_str = ''
+            else:
+                valor_str = str(valor)
+            return formatear(valor_str, *parametros)
         
-        return valor_formateado
+        return formateador
     
     def _formatear_numerico(self, valor_str: str, decimales: int, longitud: int, relleno: str, alineacion: str) -> str:
         """Formatea un valor numérico entero."""
@@ -182,14 +521,14 @@ class GeneratorSimple:
                 # Intentar parsear diferentes formatos de fecha
                 if isinstance(valor_str, str):
                     # Formato YYYY-MM-DD
-                    if re.match(r'\d{4}-\d{2}-\d{2}', valor_str):
+                    if _FECHA_ISO.match(valor_str):
                         fecha_str = valor_str.replace('-', '')
                     # Formato DD/MM/YYYY
-                    elif re.match(r'\d{2}/\d{2}/\d{4}', valor_str):
+                    elif _FECHA_DMY_BARRA.match(valor_str):
                         partes = valor_str.split('/')
                         fecha_str = f"{partes[2]}{partes[1]}{partes[0]}"
                     # Formato DD-MM-YYYY
-                    elif re.match(r'\d{2}-\d{2}-\d{4}', valor_str):
+                    elif _FECHA_DMY_GUION.match(valor_str):
                         partes = valor_str.split('-')
                         fecha_str = f"{partes[2]}{partes[1]}{partes[0]}"
                     else:
@@ -256,7 +595,7 @@ class GeneratorSimple:
         Returns:
             Diccionario con información del resumen
         """
-        campos_ordenados = self._obtener_campos_ordenados()
+        campos_ordenados = self.campos_ordenados
         
         # Calcular longitud total de línea
         longitud_total_linea = sum(campo['info']['longitud'] for campo in campos_ordenados)
@@ -299,7 +638,8 @@ class GeneratorSimple:
 
 
 def generar_archivo_simple(df: pd.DataFrame, dj_codigo: str, empresa: Dict[str, Any], 
-                          output_path: str = None, db_path: str = None) -> str:
+                          output_path: str = None, db_path: str = None,
+                          empresa_digest: str = None) -> str:
     """
     Función de conveniencia para generar archivo de DJ simple.
     
@@ -309,6 +649,7 @@ def generar_archivo_simple(df: pd.DataFrame, dj_codigo: str, empresa: Dict[str,
         empresa: Diccionario con datos de la empresa
         output_path: Ruta donde guardar el archivo
         db_path: Ruta opcional al archivo Access
+        empresa_digest: Huella opcional de la empresa para el nombre por defecto
         
     Returns:
         Ruta del archivo generado
@@ -317,7 +658,7 @@ def generar_archivo_simple(df: pd.DataFrame, dj_codigo: str, empresa: Dict[str,
     metadata = obtener_metadata(dj_codigo, db_path)
     
     # Crear generador y generar archivo
-    generator = GeneratorSimple(metadata, empresa)
+    generator = GeneratorSimple(metadata, empresa, empresa_digest)
     return generator.generar_archivo(df, output_path)
 
 
@@ -3,16 +3,102 @@ Procedimiento especial para DJ 1922 - Movimiento Mensual de Ventas (MMV).
 Implementa lógica específica para el procesamiento de esta declaración.
 """
 
+import numpy as np
 import pandas as pd
 from typing import Dict, Any, List, Optional
 from datetime import datetime, date
+import calendar
+import logging
 import math
+import time
+from types import MappingProxyType
 from ..dispatcher import DJDispatcher
 
+logger = logging.getLogger(__name__)
+
+# El motor calamine de pd.read_excel existe desde pandas 2.2
+_PANDAS_CON_CALAMINE = tuple(int(parte) for parte in pd.__version__.split('.')[:2]) >= (2, 2)
+
+
+def _formatear_ruts(ruts: pd.Series) -> pd.Series:
+    """
+    Formatea una columna de RUTs al estándar chileno (NUMERO-DV).
+    
+    Args:
+        ruts: Serie con RUTs en cualquier formato (con o sin puntos y guión)
+        
+    Returns:
+        Serie de strings formateados; vacío para valores nulos o vacíos
+    """
+    # Nulos o vacíos ('' , 0, ...) se formatean como texto vacío
+    vacios = ruts.isna().to_numpy().copy()
+    valores = ruts.to_numpy(dtype=object)
+    vacios[~vacios] = ~valores[~vacios].astype(bool)
+    
+    # Limpiar RUT
+    limpios = (
+        ruts.astype(object).astype(str)
+        .str.upper()
+        .str.replace('.', '', regex=False)
+        .str.replace('-', '', regex=False)
+        .str.strip()
+    )
+    
+    # Separar número y dígito verificador (los de menos de 2 caracteres quedan igual)
+    con_dv = limpios.str.len() >= 2
+    formateados = limpios.where(~con_dv, limpios.str[:-1] + '-' + limpios.str[-1])
+    
+    return formateados.where(~vacios, '')
+
+
+def _columna_constante(valor: Any, indice: pd.Index) -> Any:
+    """
+    Columna con el mismo valor en todas las filas, como categórica de una sola categoría.
+    
+    Ocupa un byte por fila en lugar de una referencia a string por fila.
+    
+    Args:
+        valor: Valor constante
+        indice: Índice del DataFrame destino
+        
+    Returns:
+        Serie categórica, o el valor tal cual si es nulo (no puede ser categoría)
+    """
+    if valor is None or (isinstance(valor, float) and math.isnan(valor)):
+        return valor
+    
+    codigos = np.zeros(len(indice), dtype=np.int8)
+    return pd.Series(pd.Categorical.from_codes(codigos, categories=[valor]), index=indice)
+
 
 class ProcedimientoMMV:
     """Procedimiento especial para DJ 1922 (Movimiento Mensual de Ventas)."""
     
+    # Mapeo de campos de ventas a campos DJ 1922
+    # (Estos mapeos deberían venir de configuración o metadata)
+    _MAPEO_CAMPOS = (
+        ('fecha_documento', 'C1'),  # Fecha del documento
+        ('tipo_documento', 'C2'),   # Tipo de documento
+        ('numero_documento', 'C3'), # Número de documento
+        ('rut_cliente', 'C4'),      # RUT del cliente
+        ('nombre_cliente', 'C5'),   # Nombre del cliente
+        ('monto_neto', 'C6'),       # Monto neto
+        ('monto_iva', 'C7'),        # Monto IVA
+        ('monto_total', 'C8'),      # Monto total
+    )
+    
+    # Valores por defecto de campos faltantes (C1 usa la fecha del día, ver
+    # _obtener_valor_defecto). Esta lógica podría venir de la metadata
+    _VALORES_DEFECTO = MappingProxyType({
+        'C2': 33,  # Factura electrónica por defecto
+        'C3': 0,
+        'C4': '',
+        'C5': '',
+        'C6': 0,
+        'C7': 0,
+        'C8': 0
+    })
+    
     def __init__(self, db_path: str = None):
         """
         Inicializa el procedimiento MMV.
@@ -40,6 +126,7 @@ class ProcedimientoMMV:
         if opciones is None:
             opciones = {}
         
+        inicio_ns = time.perf_counter_ns()
         resultado = {
             "dj_codigo": self.dj_codigo,
             "periodo": periodo,
@@ -52,25 +139,35 @@ class ProcedimientoMMV:
         
         try:
             # 1. Validar período
-            print(f"Validando período {periodo}...")
+            logger.info("Validando período %s...", periodo)
             self._validar_periodo(periodo)
             resultado["pasos_mmv"].append("periodo_validado")
             
+            # Sin ventas no hay nada que transformar, validar ni generar
+            if datos_ventas is None or datos_ventas.empty:
+                resultado["filas_procesadas"] = 0
+                resultado["pasos_mmv"].append("sin_datos")
+                resultado["exito"] = True
+                return resultado
+            
             # 2. Procesar y transformar datos de ventas
-            print("Procesando datos de ventas...")
+            logger.info("Procesando datos de ventas...")
             df_transformado = self._transformar_datos_ventas(datos_ventas, periodo, empresa)
             resultado["filas_procesadas"] = len(df_transformado)
             resultado["pasos_mmv"].append("datos_transformados")
             
             # 3. Aplicar validaciones específicas de MMV
-            print("Aplicando validaciones específicas MMV...")
+            logger.info("Aplicando validaciones específicas MMV...")
             errores_mmv = self._validar_mmv_especifico(df_transformado, periodo)
             if errores_mmv:
                 resultado["errores_mmv"].extend(errores_mmv)
             resultado["pasos_mmv"].append("validaciones_mmv")
             
+            # Formato final de los campos antes de entregarlos al sistema general
+            df_transformado = self._finalizar_salida(df_transformado)
+            
             # 4. Procesar con dispatcher general
-            print("Procesando con sistema general...")
+            logger.info("Procesando con sistema general...")
             opciones_dispatcher = {
                 **opciones,
                 "validaciones_adicionales": errores_mmv,
@@ -92,9 +189,7 @@ class ProcedimientoMMV:
         
         finally:
             resultado["fin_proceso"] = datetime.now()
-            resultado["duracion_total"] = (
-                resultado["fin_proceso"] - resultado["inicio_proceso"]
-            ).total_seconds()
+            resultado["duracion_total"] = (time.perf_counter_ns() - inicio_ns) / 1e9
         
         return resultado
     
@@ -131,29 +226,17 @@ class ProcedimientoMMV:
         Returns:
             DataFrame transformado según estructura DJ 1922
         """
-        # Crear DataFrame base con estructura DJ 1922
-        df_mmv = pd.DataFrame()
-        
-        # Mapeo de campos de ventas a campos DJ 1922
-        # (Estos mapeos deberían venir de configuración o metadata)
-        mapeo_campos = {
-            'fecha_documento': 'C1',  # Fecha del documento
-            'tipo_documento': 'C2',   # Tipo de documento
-            'numero_documento': 'C3', # Número de documento
-            'rut_cliente': 'C4',      # RUT del cliente
-            'nombre_cliente': 'C5',   # Nombre del cliente
-            'monto_neto': 'C6',       # Monto neto
-            'monto_iva': 'C7',        # Monto IVA
-            'monto_total': 'C8'       # Monto total
-        }
-        
         # Aplicar mapeo básico
-        for campo_origen, campo_destino in mapeo_campos.items():
+        columnas = {}
+        for campo_origen, campo_destino in self._MAPEO_CAMPOS:
             if campo_origen in datos_ventas.columns:
-                df_mmv[campo_destino] = datos_ventas[campo_origen]
+                columnas[campo_destino] = datos_ventas[campo_origen]
             else:
                 # Campo faltante, llenar con valores por defecto
-                df_mmv[campo_destino] = self._obtener_valor_defecto(campo_destino)
+                columnas[campo_destino] = self._obtener_valor_defecto(campo_destino)
+        
+        # Crear DataFrame con estructura DJ 1922 en una sola construcción
+        df_mmv = pd.DataFrame(columnas, index=datos_ventas.index, copy=False)
         
         # Transformaciones específicas
         df_mmv = self._aplicar_transformaciones_mmv(df_mmv, periodo, empresa)
@@ -162,82 +245,71 @@ class ProcedimientoMMV:
     
     def _obtener_valor_defecto(self, campo_codigo: str) -> Any:
         """Obtiene valor por defecto para un campo según su tipo."""
-        # Esta lógica podría venir de la metadata
-        valores_defecto = {
-            'C1': datetime.now().date(),
-            'C2': 33,  # Factura electrónica por defecto
-            'C3': 0,
-            'C4': '',
-            'C5': '',
-            'C6': 0,
-            'C7': 0,
-            'C8': 0
-        }
+        if campo_codigo == 'C1':
+            return datetime.now().date()
         
-        return valores_defecto.get(campo_codigo, '')
+        return self._VALORES_DEFECTO.get(campo_codigo, '')
     
     def _aplicar_transformaciones_mmv(self, df: pd.DataFrame, periodo: str, 
                                      empresa: Dict[str, Any]) -> pd.DataFrame:
         """Aplica transformaciones específicas para MMV."""
+        # Las columnas se calculan sobre un diccionario y el DataFrame se arma una
+        # sola vez al final, sin asignaciones sucesivas sobre el bloque de datos
+        columnas = dict(df.items())
         
-        # 1. Formatear fechas
-        if 'C1' in df.columns:
-            df['C1'] = pd.to_datetime(df['C1']).dt.strftime('%Y%m%d')
+        # 1. Convertir fechas (se formatean como YYYYMMDD en _finalizar_salida,
+        #    así las validaciones usan las fechas sin volver a parsearlas)
+        if 'C1' in columnas:
+            columnas['C1'] = pd.to_datetime(columnas['C1'], cache=True)
         
         # 2. Validar y formatear RUTs
-        if 'C4' in df.columns:
-            df['C4'] = df['C4'].apply(self._formatear_rut)
+        if 'C4' in columnas:
+            columnas['C4'] = _formatear_ruts(columnas['C4'])
         
         # 3. Calcular montos si faltan
-        if 'C6' in df.columns and 'C7' in df.columns and 'C8' in df.columns:
-            # Si falta monto total, calcularlo
-            mask_total_faltante = (df['C8'] == 0) | df['C8'].isna()
-            df.loc[mask_total_faltante, 'C8'] = (
-                df.loc[mask_total_faltante, 'C6'] + df.loc[mask_total_faltante, 'C7']
-            )
+        if 'C6' in columnas and 'C7' in columnas and 'C8' in columnas:
+            neto, iva, total = columnas['C6'], columnas['C7'], columnas['C8']
+            
+            # Si falta monto total, calcularlo con el IVA original (columna completa)
+            columnas['C8'] = total.mask((total == 0) | total.isna(), neto + iva)
             
             # Si falta IVA, calcularlo (19%)
-            mask_iva_faltante = (df['C7'] == 0) | df['C7'].isna()
-            df.loc[mask_iva_faltante, 'C7'] = (
-                df.loc[mask_iva_faltante, 'C6'] * 0.19
-            ).round(0)
+            columnas['C7'] = iva.mask((iva == 0) | iva.isna(), (neto * 0.19).round(0))
         
         # 4. Agregar campos adicionales de control
-        df['_PERIODO'] = periodo
-        df['_RUT_EMPRESA'] = empresa.get('rut', '')
-        df['_FECHA_PROCESO'] = datetime.now().strftime('%Y%m%d')
+        columnas['_PERIODO'] = _columna_constante(periodo, df.index)
+        columnas['_RUT_EMPRESA'] = _columna_constante(empresa.get('rut', ''), df.index)
+        columnas['_FECHA_PROCESO'] = _columna_constante(datetime.now().strftime('%Y%m%d'), df.index)
+        
+        return pd.DataFrame(columnas, index=df.index, copy=False)
+    
+    def _finalizar_salida(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Da el formato de salida a los campos que se mantienen tipados durante el proceso."""
+        if 'C1' in df.columns and pd.api.types.is_datetime64_any_dtype(df['C1']):
+            df['C1'] = df['C1'].dt.strftime('%Y%m%d')
         
         return df
     
     def _formatear_rut(self, rut: str) -> str:
         """Formatea un RUT al estándar chileno."""
-        if pd.isna(rut) or not rut:
-            return ''
-        
-        # Limpiar RUT
-        rut_limpio = str(rut).upper().replace('.', '').replace('-', '').strip()
-        
-        # Validar formato básico
-        if len(rut_limpio) < 2:
-            return rut_limpio
-        
-        # Separar número y dígito verificador
-        numero = rut_limpio[:-1]
-        dv = rut_limpio[-1]
-        
-        # Formatear con guión
-        return f"{numero}-{dv}"
+        return _formatear_ruts(pd.Series([rut], dtype=object)).iloc[0]
     
     def _validar_mmv_especifico(self, df: pd.DataFrame, periodo: str) -> List[str]:
         """Aplica validaciones específicas del MMV."""
         errores = []
         
+        if df.empty:
+            return errores
+        
         # 1. Validar que no haya documentos duplicados
         if 'C2' in df.columns and 'C3' in df.columns:
-            duplicados = df.groupby(['C2', 'C3']).size()
-            docs_duplicados = duplicados[duplicados > 1]
-            if len(docs_duplicados) > 0:
-                errores.append(f"Se encontraron {len(docs_duplicados)} documentos duplicados")
+            # Una pasada de hash marca las repeticiones; se cuentan los documentos
+            # (tipo, número) distintos entre ellas, sin claves nulas como en groupby
+            claves = df[['C2', 'C3']]
+            repetidas = claves.duplicated() & claves.notna().all(axis=1)
+            docs_duplicados = len(claves[repetidas].drop_duplicates())
+            if docs_duplicados > 0:
+                errores.append(f"Se encontraron {docs_duplicados} documentos duplicados")
         
         # 2. Validar rangos de montos
         if 'C6' in df.columns:  # Monto neto
@@ -247,31 +319,38 @@ class ProcedimientoMMV:
         
         # 3. Validar coherencia IVA
         if 'C6' in df.columns and 'C7' in df.columns:
-            # Tolerancia del 1% para diferencias de redondeo
-            iva_esperado = (df['C6'] * 0.19).round(0)
-            diferencia = abs(df['C7'] - iva_esperado)
-            tolerancia = df['C6'] * 0.01  # 1% de tolerancia
+            # Tolerancia del 1% para diferencias de redondeo (una sola pasada sobre arreglos)
+            neto = df['C6'].to_numpy(dtype='float64', na_value=np.nan)
+            iva = df['C7'].to_numpy(dtype='float64', na_value=np.nan)
             
-            iva_inconsistente = diferencia > tolerancia
-            if iva_inconsistente.sum() > 0:
-                errores.append(f"Se encontraron {iva_inconsistente.sum()} documentos con IVA inconsistente")
+            iva_inconsistente = int((np.abs(iva - np.round(neto * 0.19)) > neto * 0.01).sum())
+            if iva_inconsistente > 0:
+                errores.append(f"Se encontraron {iva_inconsistente} documentos con IVA inconsistente")
         
         # 4. Validar fechas del período
         if 'C1' in df.columns:
             año_periodo = int(periodo[:4])
             mes_periodo = int(periodo[4:6])
             
-            # Convertir fechas para validación
-            fechas_doc = pd.to_datetime(df['C1'], format='%Y%m%d', errors='coerce')
+            # Fechas ya convertidas en la transformación; si vienen como texto YYYYMMDD,
+            # las fechas válidas del período son pocas cadenas conocidas: basta un isin
+            # y solo se parsea el resto (normalmente vacío)
+            if pd.api.types.is_datetime64_any_dtype(df['C1']):
+                fechas_doc = df['C1']
+            else:
+                dias_mes = calendar.monthrange(año_periodo, mes_periodo)[1] if 1 <= mes_periodo <= 12 else 0
+                en_periodo = df['C1'].isin([f"{periodo}{dia:02d}" for dia in range(1, dias_mes + 1)])
+                fechas_doc = pd.to_datetime(
+                    df['C1'][~en_periodo], format='%Y%m%d', errors='coerce', cache=True
+                )
             
-            # Documentos fuera del período
-            fuera_periodo = (
-                (fechas_doc.dt.year != año_periodo) | 
-                (fechas_doc.dt.month != mes_periodo)
-            )
+            # Documentos fuera del período: una comparación sobre el entero AAAAMM
+            # (las fechas nulas quedan en NaN y cuentan como fuera del período)
+            año_mes = fechas_doc.dt.year.to_numpy() * 100 + fechas_doc.dt.month.to_numpy()
+            docs_fuera = int((año_mes != año_periodo * 100 + mes_periodo).sum())
             
-            if fuera_periodo.sum() > 0:
-                errores.append(f"Se encontraron {fuera_periodo.sum()} documentos fuera del período {periodo}")
+            if docs_fuera > 0:
+                errores.append(f"Se encontraron {docs_fuera} documentos fuera del período {periodo}")
         
         return errores
     
@@ -290,13 +369,15 @@ class ProcedimientoMMV:
         
         # Resumen de montos
         if 'C6' in df.columns and 'C7' in df.columns and 'C8' in df.columns:
+            # Todas las agregaciones en una sola llamada
+            estadisticas = df.agg({'C6': ['sum'], 'C7': ['sum'], 'C8': ['sum', 'mean', 'max', 'min']})
             resumen["montos"] = {
-                "total_neto": float(df['C6'].sum()),
-                "total_iva": float(df['C7'].sum()),
-                "total_bruto": float(df['C8'].sum()),
-                "promedio_documento": float(df['C8'].mean()),
-                "documento_mayor": float(df['C8'].max()),
-                "documento_menor": float(df['C8'].min())
+                "total_neto": float(estadisticas.at['sum', 'C6']),
+                "total_iva": float(estadisticas.at['sum', 'C7']),
+                "total_bruto": float(estadisticas.at['sum', 'C8']),
+                "promedio_documento": float(estadisticas.at['mean', 'C8']),
+                "documento_mayor": float(estadisticas.at['max', 'C8']),
+                "documento_menor": float(estadisticas.at['min', 'C8'])
             }
         
         # Top 10 clientes por monto
@@ -307,6 +388,35 @@ class ProcedimientoMMV:
         return resumen
 
 
+def _leer_excel(ruta_excel: str) -> pd.DataFrame:
+    """
+    Lee el Excel de ventas evitando el parser en Python puro de openpyxl.
+    
+    Usa el lector en Rust (calamine) vía Polars si está disponible, luego el
+    motor calamine de pandas (pandas >= 2.2 con python-calamine), y como
+    último recurso el motor por defecto.
+    
+    Args:
+        ruta_excel: Ruta al archivo Excel
+        
+    Returns:
+        DataFrame con los datos de la primera hoja
+    """
+    try:
+        import polars as pl
+        return pl.read_excel(ruta_excel, engine='calamine').to_pandas()
+    except ImportError:
+        pass
+    
+    if _PANDAS_CON_CALAMINE:
+        try:
+            return pd.read_excel(ruta_excel, engine='calamine')
+        except ImportError:  # python-calamine no instalado
+            pass
+    
+    return pd.read_excel(ruta_excel)
+
+
 def procesar_mmv_desde_excel(ruta_excel: str, empresa: Dict[str, Any], periodo: str,
                            opciones: Dict[str, Any] = None, db_path: str = None) -> Dict[str, Any]:
     """
@@ -323,7 +433,7 @@ def procesar_mmv_desde_excel(ruta_excel: str, empresa: Dict[str, Any], periodo:
         Resultado del procesamiento MMV
     """
     # Cargar datos de ventas
-    datos_ventas = pd.read_excel(ruta_excel)
+    datos_ventas = _leer_excel(ruta_excel)
     
     # Procesar con MMV
     mmv = ProcedimientoMMV(db_path)
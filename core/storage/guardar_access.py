@@ -3,30 +3,78 @@ Módulo para guardar DataFrames validados en la base de datos Access.
 Maneja la inserción de datos en tablas de Access con manejo de errores y transacciones.
 """
 
+import numpy as np
 import pandas as pd
 import pyodbc
 from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 from pathlib import Path
-from ..access_schema import AccessSchema
+from ..access_schema import obtener_schema
+
+
+# Antes de pandas 3, concat copia los bloques salvo que se pida copy=False.
+# Desde pandas 3 (Copy-on-Write) no copia y el parámetro está obsoleto.
+_CONCAT_SIN_COPIA = {'copy': False} if int(pd.__version__.split('.')[0]) < 3 else {}
+
+
+def _valores_python(serie: pd.Series) -> np.ndarray:
+    """
+    Convierte una columna a un arreglo de objetos Python listo para el driver ODBC.
+    
+    Los nulos (NaN, NaT, None, pd.NA) quedan como None y las fechas como datetime.
+    
+    Args:
+        serie: Columna del DataFrame a insertar
+        
+    Returns:
+        Arreglo object con un valor nativo por fila
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        valores = serie.array.to_pydatetime()
+    else:
+        valores = serie.to_numpy(dtype=object, copy=True)
+        # Columnas object que traen Timestamps sueltos (p. ej. fechas leídas desde Excel)
+        tipo_inferido = pd.api.types.infer_dtype(valores, skipna=True)
+        if 'datetime' in tipo_inferido or tipo_inferido.startswith('mixed'):
+            for k, valor in enumerate(valores):
+                if isinstance(valor, pd.Timestamp):
+                    valores[k] = valor.to_pydatetime()
+    
+    valores[serie.isna().to_numpy()] = None
+    return valores
+
+
+def _identificador(nombre: Any) -> str:
+    """Nombre de tabla o columna entre corchetes (se respeta si ya los trae)."""
+    nombre = str(nombre)
+    if nombre.startswith('[') and nombre.endswith(']'):
+        return nombre
+    return f"[{nombre}]"
 
 
 class AccessStorage:
     """Manejador de almacenamiento en Access."""
     
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: str = None, fast_executemany: bool = True):
         """
         Inicializa el manejador de almacenamiento.
         
         Args:
             db_path: Ruta al archivo .accdb. Si no se especifica, usa la ruta por defecto.
+            fast_executemany: Envía cada lote como arreglo de parámetros en una sola
+                llamada al driver. Desactivar si el driver ODBC no lo soporta.
         """
-        self.access_schema = AccessSchema(db_path)
+        # Instancia compartida por ruta: reutiliza la conexión ODBC abierta por hilo
+        # en lugar de conectar de nuevo en cada guardado
+        self.access_schema = obtener_schema(db_path)
         self.db_path = self.access_schema.db_path
+        self.fast_executemany = fast_executemany
+        self._tablas_verificadas = set()
+        self._queries_insert = {}
     
     def guardar_dataframe(self, df: pd.DataFrame, tabla_destino: str, 
                          dj_codigo: str, empresa: Dict[str, Any],
-                         batch_size: int = 1000) -> Dict[str, Any]:
+                         batch_size: int = 5000) -> Dict[str, Any]:
         """
         Guarda un DataFrame en una tabla de Access.
         
@@ -51,10 +99,8 @@ class AccessStorage:
         }
         
         try:
-            with self.access_schema._get_connection() as conn:
-                # Iniciar transacción
-                conn.autocommit = False
-                
+            # La conexión ya trabaja sin autocommit: todos los lotes van en una transacción
+            with self.access_schema._conexion() as conn:
                 try:
                     # Verificar que la tabla existe
                     self._verificar_tabla(conn, tabla_destino)
@@ -94,13 +140,33 @@ class AccessStorage:
         return resultado
     
     def _verificar_tabla(self, conn: pyodbc.Connection, tabla_destino: str) -> None:
-        """Verifica que la tabla de destino existe en Access."""
+        """
+        Verifica que la tabla de destino existe en Access.
+        
+        Consulta el catálogo ODBC (solo metadatos, sin leer filas) y recuerda las
+        tablas ya verificadas para no repetir la consulta en guardados sucesivos.
+        """
+        if tabla_destino in self._tablas_verificadas:
+            return
+        
+        # Nombre sin corchetes: el catálogo recibe el nombre real de la tabla
+        nombre = _identificador(tabla_destino)[1:-1]
+        
         cursor = conn.cursor()
         try:
-            # Intentar una consulta simple para verificar existencia
-            cursor.execute(f"SELECT TOP 1 * FROM {tabla_destino}")
-        except pyodbc.Error:
+            # Solo tablas de usuario (ni vistas ni tablas de sistema). El nombre
+            # se usa como patrón ('_' es comodín): comparar el nombre exacto
+            encontrada = any(
+                fila.table_name.lower() == nombre.lower()
+                for fila in cursor.tables(table=nombre, tableType='TABLE')
+            )
+        except pyodbc.Error as e:
+            raise ValueError(f"No se pudo verificar la tabla '{tabla_destino}': {e}")
+        
+        if not encontrada:
             raise ValueError(f"La tabla '{tabla_destino}' no existe en la base de datos")
+        
+        self._tablas_verificadas.add(tabla_destino)
     
     def _preparar_dataframe(self, df: pd.DataFrame, dj_codigo: str, 
                            empresa: Dict[str, Any]) -> pd.DataFrame:
@@ -115,21 +181,31 @@ class AccessStorage:
         Returns:
             DataFrame preparado con metadatos
         """
-        df_preparado = df.copy()
-        
-        # Agregar columnas de metadatos
-        df_preparado['DJ_CODIGO'] = dj_codigo
-        df_preparado['RUT_EMPRESA'] = empresa.get('rut', '')
-        df_preparado['NOMBRE_EMPRESA'] = empresa.get('nombre', '')
-        df_preparado['FECHA_CARGA'] = datetime.now()
-        df_preparado['USUARIO_CARGA'] = empresa.get('usuario', 'SISTEMA')
-        df_preparado['ESTADO'] = 'CARGADO'
-        
-        # Generar ID único para cada fila
-        df_preparado['ID_REGISTRO'] = [
-            f"{dj_codigo}_{empresa.get('rut', '')}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{i:06d}"
-            for i in range(len(df_preparado))
-        ]
+        ahora = datetime.now()
+        
+        # Generar ID único para cada fila: prefijo común (una sola marca de tiempo
+        # para la carga) más el correlativo de 6 dígitos, concatenados por columna
+        prefijo = f"{dj_codigo}_{empresa.get('rut', '')}_{ahora.strftime('%Y%m%d%H%M%S')}_"
+        correlativos = pd.Series(np.arange(len(df)), index=df.index)
+        
+        # Columnas de metadatos en un solo bloque (los escalares se repiten por fila)
+        metadatos = pd.DataFrame({
+            'DJ_CODIGO': dj_codigo,
+            'RUT_EMPRESA': empresa.get('rut', ''),
+            'NOMBRE_EMPRESA': empresa.get('nombre', ''),
+            'FECHA_CARGA': ahora,
+            'USUARIO_CARGA': empresa.get('usuario', 'SISTEMA'),
+            'ESTADO': 'CARGADO',
+            'ID_REGISTRO': prefijo + correlativos.astype(str).str.zfill(6)
+        }, index=df.index)
+        
+        # Los metadatos reemplazan columnas homónimas que ya traiga el DataFrame
+        repetidas = df.columns.intersection(metadatos.columns)
+        if len(repetidas) > 0:
+            df = df.drop(columns=repetidas)
+        
+        # Un solo concat sin copiar los datos del DataFrame original
+        df_preparado = pd.concat([df, metadatos], axis=1, **_CONCAT_SIN_COPIA)
         
         return df_preparado
     
@@ -148,43 +224,51 @@ class AccessStorage:
             Número total de filas insertadas
         """
         cursor = conn.cursor()
+        cursor.fast_executemany = self.fast_executemany
         total_insertadas = 0
         
-        # Obtener nombres de columnas
-        columnas = list(df.columns)
-        placeholders = ', '.join(['?' for _ in columnas])
+        # Query de inserción (la misma cadena en todos los lotes: pyodbc reutiliza
+        # la sentencia preparada mientras el SQL del cursor no cambie)
+        query_insert = self._query_insert(tabla_destino, tuple(df.columns))
         
-        # Construir query de inserción
-        query_insert = f"""
-        INSERT INTO {tabla_destino} ({', '.join(columnas)})
-        VALUES ({placeholders})
-        """
+        # Convertir cada columna una sola vez a valores nativos de Python
+        columnas_python = [_valores_python(serie) for _, serie in df.items()]
         
         # Procesar en lotes
         for i in range(0, len(df), batch_size):
-            lote = df.iloc[i:i + batch_size]
+            # Armar las tuplas del lote recorriendo las columnas en paralelo
+            datos_lote = list(zip(*(valores[i:i + batch_size] for valores in columnas_python)))
             
-            # Convertir lote a lista de tuplas
-            datos_lote = []
-            for _, fila in lote.iterrows():
-                # Convertir valores pandas a tipos nativos de Python
-                fila_convertida = []
-                for valor in fila:
-                    if pd.isna(valor):
-                        fila_convertida.append(None)
-                    elif isinstance(valor, pd.Timestamp):
-                        fila_convertida.append(valor.to_pydatetime())
-                    else:
-                        fila_convertida.append(valor)
-                
-                datos_lote.append(tuple(fila_convertida))
-            
-            # Insertar lote
-            cursor.executemany(query_insert, datos_lote)
+            # Insertar lote. Si el driver rechaza el envío como arreglo en el primer
+            # lote (antes de haber insertado nada), se repite fila a fila
+            try:
+                cursor.executemany(query_insert, datos_lote)
+            except pyodbc.Error:
+                if not cursor.fast_executemany or total_insertadas > 0:
+                    raise
+                cursor.fast_executemany = False
+                cursor.executemany(query_insert, datos_lote)
             total_insertadas += len(datos_lote)
         
         return total_insertadas
     
+    def _query_insert(self, tabla_destino: str, columnas: Tuple[str, ...]) -> str:
+        """
+        Arma el INSERT parametrizado para una tabla y sus columnas.
+        
+        Los identificadores van entre corchetes, igual que en el DDL, y la query
+        se guarda por (tabla, columnas) para no reconstruirla en cada guardado.
+        """
+        clave = (tabla_destino, columnas)
+        query = self._queries_insert.get(clave)
+        if query is None:
+            query = self._queries_insert[clave] = (
+                f"INSERT INTO {_identificador(tabla_destino)} "
+                f"({', '.join(_identificador(columna) for columna in columnas)}) "
+                f"VALUES ({', '.join('?' * len(columnas))})"
+            )
+        return query
+    
     def crear_tabla_dinamica(self, df: pd.DataFrame, nombre_tabla: str, 
                             dj_codigo: str) -> Dict[str, Any]:
         """
@@ -206,7 +290,7 @@ class AccessStorage:
         }
         
         try:
-            with self.access_schema._get_connection() as conn:
+            with self.access_schema._conexion() as conn:
                 cursor = conn.cursor()
                 
                 # Construir DDL para crear tabla
@@ -306,7 +390,7 @@ class AccessStorage:
         }
         
         try:
-            with self.access_schema._get_connection() as conn:
+            with self.access_schema._conexion() as conn:
                 cursor = conn.cursor()
                 
                 # Contar registros
@@ -344,7 +428,8 @@ class AccessStorage:
             rut_empresa: Filtro opcional por RUT empresa
             
         Returns:
-            Diccionario con resultado de la operación
+            Diccionario con resultado de la operación ("registros_eliminados" es
+            None si el driver no informa la cantidad de filas eliminadas)
         """
         resultado = {
             "exito": False,
@@ -353,7 +438,7 @@ class AccessStorage:
         }
         
         try:
-            with self.access_schema._get_connection() as conn:
+            with self.access_schema._conexion() as conn:
                 cursor = conn.cursor()
                 
                 # Construir WHERE clause
@@ -372,21 +457,25 @@ class AccessStorage:
                 if where_conditions:
                     where_clause = "WHERE " + " AND ".join(where_conditions)
                 
-                # Contar registros antes de eliminar
-                count_query = f"SELECT COUNT(*) FROM [{tabla}] {where_clause}"
-                cursor.execute(count_query, params)
-                registros_a_eliminar = cursor.fetchone()[0]
+                # Eliminar registros; el driver informa cuántas filas afectó
+                # (sin un COUNT previo con el mismo filtro)
+                delete_query = f"DELETE FROM [{tabla}] {where_clause}"
+                cursor.execute(delete_query, params)
+                registros_eliminados = cursor.rowcount
+                conn.commit()
                 
-                if registros_a_eliminar > 0:
-                    # Eliminar registros
-                    delete_query = f"DELETE FROM [{tabla}] {where_clause}"
-                    cursor.execute(delete_query, params)
-                    conn.commit()
-                    
+                if registros_eliminados < 0:
+                    # rowcount = -1: el driver no informa la cantidad; el DELETE se ejecutó
+                    resultado.update({
+                        "exito": True,
+                        "registros_eliminados": None,
+                        "mensaje": "Se eliminaron los registros (el driver no informó la cantidad)"
+                    })
+                elif registros_eliminados > 0:
                     resultado.update({
                         "exito": True,
-                        "registros_eliminados": registros_a_eliminar,
-                        "mensaje": f"Se eliminaron {registros_a_eliminar} registros"
+                        "registros_eliminados": registros_eliminados,
+                        "mensaje": f"Se eliminaron {registros_eliminados} registros"
                     })
                 else:
                     resultado.update({
@@ -402,7 +491,8 @@ class AccessStorage:
 
 
 def guardar_dj_access(df: pd.DataFrame, dj_codigo: str, empresa: Dict[str, Any],
-                     tabla_destino: str = None, db_path: str = None) -> Dict[str, Any]:
+                     tabla_destino: str = None, db_path: str = None,
+                     batch_size: int = 5000) -> Dict[str, Any]:
     """
     Función de conveniencia para guardar DataFrame de DJ en Access.
     
@@ -412,6 +502,7 @@ def guardar_dj_access(df: pd.DataFrame, dj_codigo: str, empresa: Dict[str, Any],
         empresa: Datos de la empresa
         tabla_destino: Tabla de destino (si no se especifica, usa patrón DJ_AAAA)
         db_path: Ruta opcional al archivo Access
+        batch_size: Tamaño del lote para inserción por bloques
         
     Returns:
         Resultado de la operación
@@ -420,7 +511,7 @@ def guardar_dj_access(df: pd.DataFrame, dj_codigo: str, empresa: Dict[str, Any],
         tabla_destino = f"DJ_{dj_codigo}"
     
     storage = AccessStorage(db_path)
-    return storage.guardar_dataframe(df, tabla_destino, dj_codigo, empresa)
+    return storage.guardar_dataframe(df, tabla_destino, dj_codigo, empresa, batch_size)
 
 
 if __name__ == "__main__":
@@ -3,15 +3,48 @@ Módulo para generar plantillas Excel de carga de datos.
 Genera archivos Excel con estructura, comentarios y validaciones para facilitar la carga de DJs.
 """
 
+from collections import defaultdict
+from copy import copy
+from datetime import datetime
+from itertools import zip_longest
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.styles.cell_style import StyleArray
 from openpyxl.comments import Comment
 from openpyxl.worksheet.datavalidation import DataValidation
-import pandas as pd
+from openpyxl.utils import get_column_letter, quote_sheetname
 from typing import Dict, Any, List, Optional
 from pathlib import Path
 from ..access_schema import AccessSchema, obtener_metadata
 
+# Estilos compartidos por las celdas de encabezado (colores ARGB completos,
+# con alfa opaco explícito en lugar del 00 que openpyxl antepone a 6 dígitos)
+_BORDE_FINO = Border(
+    left=Side(style='thin'),
+    right=Side(style='thin'),
+    top=Side(style='thin'),
+    bottom=Side(style='thin')
+)
+_ALINEACION_ENCABEZADO = Alignment(horizontal="center", vertical="center", wrap_text=True)
+_FUENTE_NOMBRE = Font(bold=True, color="FFFFFFFF")
+_RELLENO_NOMBRE = PatternFill(start_color="FF366092", end_color="FF366092", fill_type="solid")
+_FUENTE_CODIGO = Font(bold=True, color="FF000000")
+_RELLENO_CODIGO = PatternFill(start_color="FFD9E1F2", end_color="FFD9E1F2", fill_type="solid")
+_FUENTE_TITULO = Font(bold=True, size=16, color="FF366092")
+_FUENTE_SECCION = Font(bold=True)
+
+# Comentarios de encabezado
+_AUTOR_COMENTARIO = "Sistema DJ"
+_ANCHO_COMENTARIO = 300
+_ALTO_COMENTARIO = 200
+
+# Validaciones de lista: Excel limita el origen en línea a 255 caracteres;
+# las listas más largas se escriben en una hoja oculta y se referencian por rango
+_HOJA_LISTAS = "_Listas"
+_LARGO_MAXIMO_LISTA = 255
+_MAXIMO_VALORES_EN_LINEA = 100
+
 
 class TemplateGenerator:
     """Generador de plantillas Excel para carga de DJs."""
@@ -31,6 +64,33 @@ class TemplateGenerator:
         self.tipo_dj = metadata['declaracion']['tipo']
         self.campos = metadata['campos']
         self.validaciones = metadata['validaciones']
+        
+        # Campos ordenados por posición y agrupados por sección: se calculan
+        # una vez y se reutilizan en todas las hojas
+        self._campos_ordenados = sorted(
+            ({'codigo': codigo_campo, 'info': info_campo}
+             for codigo_campo, info_campo in self.campos.items()),
+            key=lambda x: x['info']['posicion']
+        )
+        self._campos_por_seccion = defaultdict(list)
+        for campo in self._campos_ordenados:
+            if campo['info']['seccion']:
+                self._campos_por_seccion[campo['info']['seccion']].append(campo)
+        
+        # Resúmenes para la hoja de instrucciones
+        self._campos_obligatorios = [
+            (codigo_campo, info_campo['nombre'])
+            for codigo_campo, info_campo in self.campos.items()
+            if info_campo['obligatorio']
+        ]
+        self._total_validaciones = sum(len(v) for v in self.validaciones.values())
+        
+        # Valores de tablas lookup ya leídos, por nombre de tabla
+        self._valores_lookup: Dict[str, List[str]] = {}
+        
+        # Listas que van a la hoja oculta: rango por tabla y valores por columna
+        self._rangos_listas: Dict[str, str] = {}
+        self._columnas_listas: List[List[str]] = []
     
     def generar_template(self, output_path: str = None) -> str:
         """
@@ -45,13 +105,20 @@ class TemplateGenerator:
         if output_path is None:
             output_path = f"template_DJ{self.dj_codigo}_{self.nombre_dj.replace(' ', '_')}.xlsx"
         
-        wb = Workbook()
+        # Modo write_only: las filas se escriben directo al XML sin mantener la
+        # grilla de celdas en memoria
+        wb = Workbook(write_only=True)
+        self._rangos_listas.clear()
+        self._columnas_listas.clear()
         
         if self.tipo_dj == 'SIMPLE':
             self._generar_hoja_simple(wb)
         else:  # COMPUESTA
             self._generar_hojas_compuestas(wb)
         
+        # Hoja oculta con las listas largas referenciadas por las validaciones
+        self._agregar_hoja_listas(wb)
+        
         # Agregar hoja de instrucciones
         self._agregar_hoja_instrucciones(wb)
         
@@ -69,22 +136,15 @@ class TemplateGenerator:
     
     def _generar_hoja_simple(self, wb: Workbook) -> None:
         """Genera una sola hoja para DJ simple."""
-        # Remover hoja por defecto y crear nueva
-        wb.remove(wb.active)
         ws = wb.create_sheet("Datos")
         
         # Obtener campos ordenados por posición
         campos_ordenados = self._obtener_campos_ordenados()
         
-        self._configurar_encabezados(ws, campos_ordenados)
-        self._agregar_comentarios_y_validaciones(ws, campos_ordenados)
-        self._aplicar_estilos(ws, len(campos_ordenados))
+        self._escribir_hoja_datos(ws, campos_ordenados)
     
     def _generar_hojas_compuestas(self, wb: Workbook) -> None:
         """Genera múltiples hojas para DJ compuesta."""
-        # Remover hoja por defecto
-        wb.remove(wb.active)
-        
         # Agrupar campos por sección
         secciones = self._obtener_secciones()
         
@@ -92,70 +152,85 @@ class TemplateGenerator:
             ws = wb.create_sheet(seccion)
             campos_seccion = self._obtener_campos_seccion(seccion)
             
-            self._configurar_encabezados(ws, campos_seccion)
-            self._agregar_comentarios_y_validaciones(ws, campos_seccion)
-            self._aplicar_estilos(ws, len(campos_seccion))
+            self._escribir_hoja_datos(ws, campos_seccion)
+    
+    def _escribir_hoja_datos(self, ws, campos: List[Dict[str, Any]]) -> None:
+        """
+        Escribe una hoja de carga: formato, validaciones y las dos filas de encabezados.
+        
+        En modo write_only el formato de filas y columnas debe quedar definido
+        antes de escribir la primera fila.
+        """
+        # Letras de columna (A..Z, AA..): se calculan una vez por hoja
+        letras = [get_column_letter(col) for col in range(1, len(campos) + 1)]
+        
+        self._aplicar_estilos(ws, letras)
+        self._agregar_validaciones(ws, campos, letras)
+        self._configurar_encabezados(ws, campos)
     
     def _obtener_campos_ordenados(self) -> List[Dict[str, Any]]:
         """Obtiene lista de campos ordenados por posición."""
-        campos_lista = []
-        for codigo_campo, info_campo in self.campos.items():
-            campos_lista.append({
-                'codigo': codigo_campo,
-                'info': info_campo
-            })
-        
-        return sorted(campos_lista, key=lambda x: x['info']['posicion'])
+        return self._campos_ordenados
     
     def _obtener_secciones(self) -> List[str]:
         """Obtiene lista única de secciones para DJ compuestas."""
-        secciones = set()
-        for info_campo in self.campos.values():
-            if info_campo['seccion']:
-                secciones.add(info_campo['seccion'])
-        
-        return sorted(list(secciones))
+        return sorted(self._campos_por_seccion)
     
     def _obtener_campos_seccion(self, seccion: str) -> List[Dict[str, Any]]:
         """Obtiene campos de una sección específica ordenados por posición."""
-        campos_seccion = []
-        for codigo_campo, info_campo in self.campos.items():
-            if info_campo['seccion'] == seccion:
-                campos_seccion.append({
-                    'codigo': codigo_campo,
-                    'info': info_campo
-                })
-        
-        return sorted(campos_seccion, key=lambda x: x['info']['posicion'])
+        return self._campos_por_seccion.get(seccion, [])
     
     def _configurar_encabezados(self, ws, campos: List[Dict[str, Any]]) -> None:
-        """Configura las dos filas de encabezados."""
-        # Fila 1: Nombres de campos
-        for col, campo in enumerate(campos, 1):
-            ws.cell(row=1, column=col, value=campo['info']['nombre'])
-        
-        # Fila 2: Códigos técnicos (headers del DataFrame)
-        for col, campo in enumerate(campos, 1):
-            ws.cell(row=2, column=col, value=campo['codigo'])
-    
-    def _agregar_comentarios_y_validaciones(self, ws, campos: List[Dict[str, Any]]) -> None:
-        """Agrega comentarios explicativos y validaciones a las celdas."""
-        for col, campo in enumerate(campos, 1):
-            codigo_campo = campo['codigo']
-            info_campo = campo['info']
-            
-            # Celda de nombre de campo (fila 1)
-            celda_nombre = ws.cell(row=1, column=col)
+        """Escribe las dos filas de encabezados con sus estilos y comentarios."""
+        # Cada combinación de estilos se registra una sola vez en el libro
+        estilo_nombre = self._estilo_encabezado(ws, _FUENTE_NOMBRE, _RELLENO_NOMBRE)
+        estilo_codigo = self._estilo_encabezado(ws, _FUENTE_CODIGO, _RELLENO_CODIGO)
+        
+        # Fila 1: Nombres de campos, con comentario explicativo
+        fila_nombres = []
+        for campo in campos:
+            celda = self._celda_encabezado(ws, campo['info']['nombre'], estilo_nombre)
             
             # Crear comentario con información detallada
-            comentario_texto = self._generar_texto_comentario(codigo_campo, info_campo)
-            comentario = Comment(comentario_texto, "Sistema DJ")
-            comentario.width = 300
-            comentario.height = 200
-            celda_nombre.comment = comentario
+            comentario_texto = self._generar_texto_comentario(campo['codigo'], campo['info'])
+            celda.comment = Comment(comentario_texto, _AUTOR_COMENTARIO,
+                                    height=_ALTO_COMENTARIO, width=_ANCHO_COMENTARIO)
             
-            # Agregar validación de datos si aplica
-            self._agregar_validacion_columna(ws, col, codigo_campo, info_campo)
+            fila_nombres.append(celda)
+        
+        # Fila 2: Códigos técnicos (headers del DataFrame)
+        fila_codigos = [self._celda_encabezado(ws, campo['codigo'], estilo_codigo) for campo in campos]
+        
+        ws.append(fila_nombres)
+        ws.append(fila_codigos)
+    
+    @staticmethod
+    def _estilo_encabezado(ws, fuente: Font, relleno: PatternFill) -> StyleArray:
+        """
+        Registra en el libro los estilos de un tipo de encabezado.
+        
+        Asignar Font/Fill/Alignment/Border a una celda busca cada objeto en los
+        registros del libro (hash recursivo); se hace una vez y las celdas copian
+        los índices resultantes.
+        """
+        plantilla = WriteOnlyCell(ws)
+        plantilla.font = fuente
+        plantilla.fill = relleno
+        plantilla.alignment = _ALINEACION_ENCABEZADO
+        plantilla.border = _BORDE_FINO
+        return plantilla._style
+    
+    @staticmethod
+    def _celda_encabezado(ws, valor: Any, estilo: StyleArray) -> WriteOnlyCell:
+        """Crea una celda de encabezado con un estilo ya registrado."""
+        celda = WriteOnlyCell(ws, value=valor)
+        celda._style = copy(estilo)
+        return celda
+    
+    def _agregar_validaciones(self, ws, campos: List[Dict[str, Any]], letras: List[str]) -> None:
+        """Agrega las validaciones de datos de Excel de cada columna."""
+        for column_letter, campo in zip(letras, campos):
+            self._agregar_validacion_columna(ws, column_letter, campo['codigo'], campo['info'])
     
     def _generar_texto_comentario(self, codigo_campo: str, info_campo: Dict[str, Any]) -> str:
         """Genera el texto del comentario para un campo."""
@@ -189,7 +264,7 @@ class TemplateGenerator:
         
         return "\n".join(comentario_partes)
     
-    def _agregar_validacion_columna(self, ws, col: int, codigo_campo: str, info_campo: Dict[str, Any]) -> None:
+    def _agregar_validacion_columna(self, ws, column_letter: str, codigo_campo: str, info_campo: Dict[str, Any]) -> None:
         """Agrega validación de datos de Excel a una columna."""
         # Validación por longitud máxima (texto)
         if info_campo['tipo_dato'] in ['TEXT', 'VARCHAR', 'CHAR']:
@@ -207,9 +282,8 @@ class TemplateGenerator:
                 dv.promptTitle = f"Campo {codigo_campo}"
                 
                 # Aplicar a toda la columna (desde fila 3 hasta 1000)
-                column_letter = chr(64 + col)  # A=65, B=66, etc.
                 dv.add(f"{column_letter}3:{column_letter}1000")
-                ws.add_data_validation(dv)
+                ws.data_validations.append(dv)
         
         # Validación numérica
         elif info_campo['tipo_dato'] in ['INTEGER', 'DECIMAL', 'NUMERIC']:
@@ -219,83 +293,90 @@ class TemplateGenerator:
             dv.prompt = f"Ingrese un número ({info_campo['tipo_dato']})"
             dv.promptTitle = f"Campo {codigo_campo}"
             
-            column_letter = chr(64 + col)
             dv.add(f"{column_letter}3:{column_letter}1000")
-            ws.add_data_validation(dv)
+            ws.data_validations.append(dv)
         
         # Validación de lista para campos con tabla lookup
         if info_campo['tabla_lookup']:
             try:
-                valores_lookup = self._obtener_valores_lookup(info_campo['tabla_lookup'])
-                if valores_lookup and len(valores_lookup) <= 100:  # Límite de Excel
-                    dv = DataValidation(
-                        type="list",
-                        formula1=f'"{",".join(map(str, valores_lookup))}"'
-                    )
+                origen_lista = self._origen_lista(info_campo['tabla_lookup'])
+                if origen_lista:
+                    dv = DataValidation(type="list", formula1=origen_lista)
                     dv.error = "Seleccione un valor de la lista"
                     dv.errorTitle = "Valor no válido"
                     dv.prompt = "Seleccione de la lista desplegable"
                     dv.promptTitle = f"Campo {codigo_campo}"
                     
-                    column_letter = chr(64 + col)
                     dv.add(f"{column_letter}3:{column_letter}1000")
-                    ws.add_data_validation(dv)
+                    ws.data_validations.append(dv)
             except Exception:
                 pass  # Si no se puede obtener la lista, continuar sin validación
     
+    def _origen_lista(self, tabla_lookup: str) -> Optional[str]:
+        """
+        Construye el origen de la validación de lista para una tabla lookup.
+        
+        Las listas cortas van en línea; las que superan el límite de Excel se
+        registran una vez por tabla en la hoja oculta y se devuelve su rango.
+        """
+        valores_lookup = self._obtener_valores_lookup(tabla_lookup)
+        if not valores_lookup:
+            return None
+        
+        texto = ",".join(valores_lookup)
+        if len(valores_lookup) <= _MAXIMO_VALORES_EN_LINEA and len(texto) <= _LARGO_MAXIMO_LISTA:
+            return f'"{texto}"'
+        
+        if tabla_lookup not in self._rangos_listas:
+            self._columnas_listas.append(valores_lookup)
+            letra = get_column_letter(len(self._columnas_listas))
+            self._rangos_listas[tabla_lookup] = (
+                f"{quote_sheetname(_HOJA_LISTAS)}!${letra}$1:${letra}${len(valores_lookup)}"
+            )
+        return self._rangos_listas[tabla_lookup]
+    
+    def _agregar_hoja_listas(self, wb: Workbook) -> None:
+        """Escribe en una hoja oculta las listas largas, una columna por tabla lookup."""
+        if not self._columnas_listas:
+            return
+        
+        ws_listas = wb.create_sheet(_HOJA_LISTAS)
+        ws_listas.sheet_state = 'hidden'
+        for fila in zip_longest(*self._columnas_listas):
+            ws_listas.append(fila)
+    
     def _obtener_valores_lookup(self, tabla_lookup: str) -> List[str]:
-        """Obtiene valores para validación de lista desde tabla lookup."""
+        """
+        Obtiene valores para validación de lista desde tabla lookup.
+        
+        Varias columnas pueden referenciar la misma tabla; se lee y convierte
+        una sola vez por plantilla.
+        """
+        if tabla_lookup in self._valores_lookup:
+            return self._valores_lookup[tabla_lookup]
+        
+        valores = []
         try:
             df_lookup = self.access_schema.get_tabla_lookup(tabla_lookup)
-            # Usar la primera columna como valores
+            # Usar la primera columna como valores (sin nulos); str() sobre la
+            # lista de Python evita la Series intermedia de astype(str)
             if len(df_lookup.columns) > 0:
-                return df_lookup.iloc[:, 0].astype(str).tolist()
+                valores = [str(valor) for valor in df_lookup.iloc[:, 0].dropna().tolist()]
         except Exception:
             pass
-        return []
+        self._valores_lookup[tabla_lookup] = valores
+        return valores
     
-    def _aplicar_estilos(self, ws, num_columnas: int) -> None:
-        """Aplica estilos visuales a la hoja."""
-        # Estilos para encabezados
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        
-        # Aplicar estilos a encabezados
-        for col in range(1, num_columnas + 1):
-            # Fila 1: Nombres de campos
-            cell1 = ws.cell(row=1, column=col)
-            cell1.font = header_font
-            cell1.fill = header_fill
-            cell1.alignment = header_alignment
-            
-            # Fila 2: Códigos técnicos
-            cell2 = ws.cell(row=2, column=col)
-            cell2.font = Font(bold=True, color="000000")
-            cell2.fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-            cell2.alignment = header_alignment
-        
+    def _aplicar_estilos(self, ws, letras: List[str]) -> None:
+        """Aplica el formato de filas y columnas de la hoja (antes de escribir filas)."""
         # Ajustar altura de filas de encabezado
         ws.row_dimensions[1].height = 40
         ws.row_dimensions[2].height = 25
         
         # Ajustar ancho de columnas
-        for col in range(1, num_columnas + 1):
-            column_letter = chr(64 + col)
+        for column_letter in letras:
             ws.column_dimensions[column_letter].width = 15
         
-        # Agregar bordes
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        for row in range(1, 3):  # Solo encabezados
-            for col in range(1, num_columnas + 1):
-                ws.cell(row=row, column=col).border = thin_border
-        
         # Congelar paneles (fijar encabezados)
         ws.freeze_panes = "A3"
     
@@ -303,9 +384,13 @@ class TemplateGenerator:
         """Agrega una hoja con instrucciones de uso."""
         ws_inst = wb.create_sheet("Instrucciones", 0)  # Insertar al inicio
         
+        # Ajustar ancho de columna (antes de escribir filas)
+        ws_inst.column_dimensions['A'].width = 80
+        
         # Título
-        ws_inst['A1'] = f"INSTRUCCIONES - DJ {self.dj_codigo}: {self.nombre_dj}"
-        ws_inst['A1'].font = Font(bold=True, size=16, color="366092")
+        titulo = WriteOnlyCell(ws_inst, value=f"INSTRUCCIONES - DJ {self.dj_codigo}: {self.nombre_dj}")
+        titulo.font = _FUENTE_TITULO
+        ws_inst.append([titulo])
         
         # Información general
         instrucciones = [
@@ -326,14 +411,9 @@ class TemplateGenerator:
         ]
         
         # Agregar campos obligatorios
-        campos_obligatorios = [
-            f"• {codigo}: {info['nombre']}" 
-            for codigo, info in self.campos.items() 
-            if info['obligatorio']
-        ]
-        instrucciones.extend(campos_obligatorios)
+        instrucciones.extend(f"• {codigo}: {nombre}" for codigo, nombre in self._campos_obligatorios)
         
-        if not campos_obligatorios:
+        if not self._campos_obligatorios:
             instrucciones.append("• No hay campos obligatorios")
         
         instrucciones.extend([
@@ -342,8 +422,7 @@ class TemplateGenerator:
         ])
         
         # Agregar información de validaciones
-        total_validaciones = sum(len(v) for v in self.validaciones.values())
-        instrucciones.append(f"• Total de validaciones: {total_validaciones}")
+        instrucciones.append(f"• Total de validaciones: {self._total_validaciones}")
         
         for codigo_campo, validaciones_campo in self.validaciones.items():
             nombre_campo = self.campos[codigo_campo]['nombre']
@@ -357,17 +436,17 @@ class TemplateGenerator:
             "• Guarde el archivo en formato Excel (.xlsx)",
             "• Use este archivo para cargar datos en el sistema DJ",
             "",
-            f"Archivo generado: {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')}"
+            f"Archivo generado: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         ])
         
-        # Escribir instrucciones
-        for i, linea in enumerate(instrucciones):
-            ws_inst[f'A{i+1}'] = linea
+        # Escribir instrucciones, una fila por línea bajo el título
+        for linea in instrucciones:
             if linea.endswith(":") and linea not in ["", "IMPORTANTE:"]:
-                ws_inst[f'A{i+1}'].font = Font(bold=True)
-        
-        # Ajustar ancho de columna
-        ws_inst.column_dimensions['A'].width = 80
+                celda = WriteOnlyCell(ws_inst, value=linea)
+                celda.font = _FUENTE_SECCION
+                ws_inst.append([celda])
+            else:
+                ws_inst.append([linea])
 
 
 def generar_template_dj(dj_codigo: str, output_path: str = None, db_path: str = None) -> str:
@@ -30,6 +30,9 @@ class DJValidator:
         
         # Cache para tablas lookup
         self._lookup_cache = {}
+        
+        # Parte fija del contexto de eval(), compartida por todas las validaciones
+        self._contexto_base = self._crear_contexto_base()
     
     def validar_dataframe(self, df: pd.DataFrame) -> Dict[str, Any]:
         """
@@ -69,6 +72,7 @@ class DJValidator:
         
         # 2. Ejecutar validaciones por campo y fila
         columnas_con_error = set()
+        campos_a_validar = []
         
         for codigo_campo, validaciones_campo in self.validaciones.items():
             if codigo_campo not in df.columns:
@@ -81,16 +85,29 @@ class DJValidator:
                     })
                 continue
             
-            # Validar cada fila para este campo
-            for idx, valor in enumerate(df[codigo_campo]):
-                errores_fila = self._validar_campo_valor(
-                    codigo_campo, valor, idx, df
-                )
+            campos_a_validar.append(codigo_campo)
+        
+        # Se recorre fila por fila para armar el contexto de cada fila una sola vez.
+        # Los errores se agrupan por campo para mantener el orden del reporte.
+        errores_por_campo = {codigo_campo: [] for codigo_campo in campos_a_validar}
+        valores_por_campo = {codigo_campo: df[codigo_campo].tolist() for codigo_campo in campos_a_validar}
+        
+        if campos_a_validar:
+            for idx in range(len(df)):
+                contexto_fila, valores_fila = self._preparar_contexto_fila(idx, df)
                 
-                if errores_fila:
-                    resultado["errores"].extend(errores_fila)
-                    columnas_con_error.add(codigo_campo)
-                    resultado["valido"] = False
+                for codigo_campo in campos_a_validar:
+                    contexto = self._preparar_contexto_validacion(
+                        valores_por_campo[codigo_campo][idx], contexto_fila, valores_fila, codigo_campo
+                    )
+                    errores_fila = self._validar_campo_valor(codigo_campo, contexto, idx)
+                    errores_por_campo[codigo_campo].extend(errores_fila)
+        
+        for codigo_campo in campos_a_validar:
+            if errores_por_campo[codigo_campo]:
+                resultado["errores"].extend(errores_por_campo[codigo_campo])
+                columnas_con_error.add(codigo_campo)
+                resultado["valido"] = False
         
         # 3. Actualizar resumen
         resultado["resumen"]["errores_totales"] = len(resultado["errores"])
@@ -108,15 +125,14 @@ class DJValidator:
         
         return columnas_faltantes
     
-    def _validar_campo_valor(self, codigo_campo: str, valor: Any, fila_idx: int, df: pd.DataFrame) -> List[Dict[str, Any]]:
+    def _validar_campo_valor(self, codigo_campo: str, contexto: Dict[str, Any], fila_idx: int) -> List[Dict[str, Any]]:
         """
         Valida un valor específico contra todas las reglas del campo.
         
         Args:
             codigo_campo: Código del campo (C1, C2, etc.)
-            valor: Valor a validar
+            contexto: Contexto de eval() con el valor y la fila actual
             fila_idx: Índice de la fila (0-based)
-            df: DataFrame completo (para validaciones contextuales)
             
         Returns:
             Lista de errores encontrados
@@ -131,7 +147,7 @@ class DJValidator:
         for validacion in validaciones_campo:
             try:
                 error = self._ejecutar_validacion(
-                    validacion, codigo_campo, valor, fila_idx, df
+                    validacion, codigo_campo, contexto, fila_idx
                 )
                 if error:
                     errores.append(error)
@@ -147,16 +163,15 @@ class DJValidator:
         return errores
     
     def _ejecutar_validacion(self, validacion: Dict[str, Any], codigo_campo: str, 
-                           valor: Any, fila_idx: int, df: pd.DataFrame) -> Optional[Dict[str, Any]]:
+                           contexto: Dict[str, Any], fila_idx: int) -> Optional[Dict[str, Any]]:
         """
         Ejecuta una validación específica.
         
         Args:
             validacion: Diccionario con info de la validación
             codigo_campo: Código del campo
-            valor: Valor a validar
+            contexto: Contexto de eval() preparado para el valor y la fila
             fila_idx: Índice de la fila
-            df: DataFrame completo
             
         Returns:
             Diccionario con error si la validación falla, None si es válida
@@ -166,12 +181,10 @@ class DJValidator:
         codigo_validacion = validacion["codigo_validacion"]
         mensaje_error = validacion["mensaje_error"]
         
-        # Preparar contexto para eval()
-        contexto = self._preparar_contexto_validacion(valor, fila_idx, df, codigo_campo)
-        
         try:
-            # Ejecutar la expresión Python
-            resultado = eval(expresion_py, {"__builtins__": {}}, contexto)
+            # Ejecutar la expresión Python (precompilada al cargar la metadata, si existe)
+            expresion = validacion.get("expresion_code") or expresion_py
+            resultado = eval(expresion, {"__builtins__": {}}, contexto)
             
             # Si el resultado es False, hay un error de validación
             if not resultado:
@@ -192,35 +205,13 @@ class DJValidator:
         
         return None
     
-    def _preparar_contexto_validacion(self, valor: Any, fila_idx: int, df: pd.DataFrame, codigo_campo: str) -> Dict[str, Any]:
+    def _crear_contexto_base(self) -> Dict[str, Any]:
         """
-        Prepara el contexto de variables para eval().
+        Crea la parte fija del contexto de eval() (funciones y módulos).
         
-        Args:
-            valor: Valor del campo actual
-            fila_idx: Índice de la fila
-            df: DataFrame completo
-            codigo_campo: Código del campo actual
-            
-        Returns:
-            Diccionario con variables disponibles para eval()
+        Se construye una sola vez por validador en lugar de por cada valor evaluado.
         """
-        # Fila actual como Serie
-        fila_actual = df.iloc[fila_idx] if fila_idx < len(df) else pd.Series()
-        
-        contexto = {
-            # Valor actual
-            'valor': valor,
-            'v': valor,  # Alias corto
-            
-            # Información de fila
-            'fila': fila_actual,
-            'fila_idx': fila_idx,
-            'fila_num': fila_idx + 1,  # 1-based
-            
-            # DataFrame completo
-            'df': df,
-            
+        return {
             # Funciones útiles
             'len': len,
             'str': str,
@@ -251,11 +242,65 @@ class DJValidator:
             'en_lista': lambda x, lista: x in lista,
             'lookup': lambda tabla, campo_buscar, valor_buscar, campo_retorno: self._buscar_lookup(tabla, campo_buscar, valor_buscar, campo_retorno),
         }
+    
+    def _preparar_contexto_fila(self, fila_idx: int, df: pd.DataFrame) -> Tuple[Dict[str, Any], List[Tuple[str, str, Any]]]:
+        """
+        Prepara la parte del contexto que depende solo de la fila.
+        
+        Args:
+            fila_idx: Índice de la fila
+            df: DataFrame completo
+            
+        Returns:
+            Tupla (variables de fila, lista de (columna, nombre en minúsculas, valor))
+        """
+        # Fila actual como Serie
+        fila_actual = df.iloc[fila_idx] if fila_idx < len(df) else pd.Series()
+        
+        contexto_fila = {
+            # Información de fila
+            'fila': fila_actual,
+            'fila_idx': fila_idx,
+            'fila_num': fila_idx + 1,  # 1-based
+            
+            # DataFrame completo
+            'df': df,
+        }
+        
+        valores_fila = [
+            (col, col.lower(), fila_actual.get(col) if col in fila_actual else None)
+            for col in df.columns
+        ]
+        
+        return contexto_fila, valores_fila
+    
+    def _preparar_contexto_validacion(self, valor: Any, contexto_fila: Dict[str, Any],
+                                      valores_fila: List[Tuple[str, str, Any]],
+                                      codigo_campo: str) -> Dict[str, Any]:
+        """
+        Prepara el contexto de variables para eval().
+        
+        Args:
+            valor: Valor del campo actual
+            contexto_fila: Variables de la fila (de _preparar_contexto_fila)
+            valores_fila: Valores de las columnas de la fila
+            codigo_campo: Código del campo actual
+            
+        Returns:
+            Diccionario con variables disponibles para eval()
+        """
+        contexto = {
+            # Valor actual
+            'valor': valor,
+            'v': valor,  # Alias corto
+            **contexto_fila,
+            **self._contexto_base,
+        }
         
         # Agregar acceso directo a otros campos de la fila actual
-        for col in df.columns:
+        for col, nombre, valor_col in valores_fila:
             if col != codigo_campo:  # Evitar referencia circular
-                contexto[col.lower()] = fila_actual.get(col) if col in fila_actual else None
+                contexto[nombre] = valor_col
         
         return contexto
     
@@ -283,7 +328,10 @@ class DJValidator:
             resultado = tabla_df[tabla_df[campo_buscar] == valor_buscar]
             
             if len(resultado) > 0:
-                return resultado.iloc[0][campo_retorno]
+                valor = resultado.iloc[0][campo_retorno]
+                # Celdas vacías con tipos Arrow/nullable: None, como con el backend NumPy,
+                # para que las expresiones puedan evaluarlo como booleano
+                return None if valor is pd.NA else valor
             else:
                 return None
                 
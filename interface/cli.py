@@ -272,7 +272,7 @@ class DJCLI:
                 # Obtener estadísticas básicas si se solicita
                 if args.verbose:
                     try:
-                        with schema._get_connection() as conn:
+                        with schema._conexion() as conn:
                             cursor = conn.cursor()
                             
                             # Contar declaraciones
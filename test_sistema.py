@@ -83,6 +83,104 @@ def test_dataframe_processing():
         print(f"  ❌ Error en procesamiento: {e}")
         return False
 
+def test_formateo_columnas():
+    """Compara el archivo generado por columnas con líneas esperadas fijas."""
+    print("\n🧪 Probando formateo por columnas del generador...")
+    
+    import tempfile
+    import numpy as np
+    
+    try:
+        from core.generation.generator_simple import GeneratorSimple
+    except ImportError as e:
+        # El generador importa pyodbc, que requiere unixODBC instalado
+        print(f"  ⚠️ Prueba omitida, no se pudo importar el generador: {e}")
+        if 'pytest' in sys.modules:
+            import pytest
+            pytest.skip(f"Generador no importable: {e}")
+        return True
+    
+    def campo(posicion, tipo_dato, longitud, decimales=0, alineacion='LEFT', relleno=' '):
+        return {'nombre': f'Campo {posicion}', 'posicion': posicion, 'tipo_dato': tipo_dato,
+                'longitud': longitud, 'decimales': decimales, 'alineacion': alineacion,
+                'relleno': relleno, 'seccion': None}
+    
+    campos = {
+        'C1': campo(1, 'INTEGER', 8, alineacion='RIGHT', relleno='0'),
+        'C2': campo(2, 'NUMERIC', 6),
+        'C3': campo(3, 'DECIMAL', 10, decimales=2, alineacion='RIGHT', relleno='0'),
+        'C4': campo(4, 'DECIMAL', 7, decimales=0, alineacion='CENTER', relleno='*'),
+        'C5': campo(5, 'TEXT', 6),
+        'C6': campo(6, 'DATE', 8),
+        'C7': campo(7, 'VARCHAR', 4, alineacion='RIGHT'),
+    }
+    metadata = {'declaracion': {'dj_codigo': '1922', 'tipo': 'SIMPLE'}, 'campos': campos, 'validaciones': {}}
+    
+    # Enteros, decimales, texto, fechas, nulos, negativos y ceros con signo.
+    # Las líneas esperadas son las que escribía el generador original (fila por fila).
+    casos = {
+        'mixto': (pd.DataFrame({
+            'C1': [0, -5, 123456789, 7, -0, 42],
+            'C2': [1.9, -1.9, np.nan, -0.0, 0.0, 1e6],
+            'C3': [2.675, -0.0, 0.005, np.nan, -123.456, 1.005],
+            'C4': [0.5, -0.0, 2.5, -3.7, np.nan, 0.0],
+            'C5': [' abc ', None, 'héllo mundo', np.nan, '', 12],
+            'C6': [pd.Timestamp('2024-01-31'), '31/12/2023', '01-02-2023', None, pd.NaT, '2024-01-31'],
+            'C7': ['x', -0.0, 0.0, 1.0, None, 'abcdef'],
+        }), [
+            '000000001     0000000267***0***abc   20240131   x',
+            '000000-5-1    -000000000***0***      20231231-0.0',
+            '123456780     0000000001***2***héllo 20230201 0.0',
+            '000000070     0000000000***-3**               1.0',
+            '000000000     -000012346***0***                  ',
+            '000000421000000000000100***0***12    20240131abcd',
+        ]),
+        'numerico': (pd.DataFrame({
+            'C1': [1, -2, 3, 0, 0, -7],
+            'C2': [0.0, -0.0, 5.5, np.nan, -1.5, 2.0],
+            'C3': [-0.0, 0.0, 1.125, -1.125, np.nan, 99999.999],
+            'C6': [0.0, -0.0, 20240131.0, np.nan, 0.0, -0.0],
+        }), [
+            '000000010     -000000000***0***      0.0         ',
+            '000000-20     0000000000***0***      -0.0        ',
+            '000000035     0000000112***0***      20240131    ',
+            '000000000     -000000112***0***                  ',
+            '00000000-1    0000000000***0***      0.0         ',
+            '000000-72     0010000000***0***      -0.0        ',
+        ]),
+        'nulos_pandas': (pd.DataFrame({
+            'C1': pd.array([1, None, -3, 0, None, 5], dtype='Int64'),
+            'C3': pd.array([1.5, None, -0.25, 0.0, None, 2.0], dtype='Float64'),
+            'C5': pd.array(['a', None, 'b', 'c', None, 'd'], dtype='string'),
+        }), [
+            '000000010     0000000150***0***a                 ',
+            '000000000     0000000000***0***                  ',
+            '000000-30     -000000025***0***b                 ',
+            '000000000     0000000000***0***c                 ',
+            '000000000     0000000000***0***                  ',
+            '000000050     0000000200***0***d                 ',
+        ]),
+        # Sin filas (con y sin columnas): archivo vacío
+        'sin_filas': (pd.DataFrame({
+            'C1': pd.Series([], dtype='int64'),
+            'C3': pd.Series([], dtype='float64'),
+            'C5': pd.Series([], dtype='object'),
+        }), []),
+        'sin_columnas': (pd.DataFrame(), []),
+    }
+    
+    generator = GeneratorSimple(metadata, {'rut': '76123456-7'})
+    for nombre, (df, esperadas) in casos.items():
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = generator.generar_archivo(df, str(Path(directorio) / 'salida.922'))
+            with open(ruta, 'r', encoding='latin-1') as f:
+                lineas = f.read().splitlines()
+        
+        assert lineas == esperadas, f"{nombre}: {lineas} != {esperadas}"
+        print(f"  ✅ Caso '{nombre}': {len(lineas)} líneas esperadas")
+    
+    return True
+
 def test_file_structure():
     """Verifica que la estructura de archivos sea correcta."""
     print("\n🧪 Verificando estructura de archivos...")
@@ -177,6 +275,7 @@ def main():
         ("Estructura de archivos", test_file_structure),
         ("Importaciones", test_imports),
         ("Procesamiento DataFrame", test_dataframe_processing),
+        ("Formateo por columnas", test_formateo_columnas),
         ("CLI básica", test_cli_help),
     ]
     